@@ -0,0 +1,162 @@
+"""
+Benchmark each stage of the conversion pipeline.
+
+Runs over the cartridges in test_data, and over synthetic ones (see
+synthetic.py), and reports the best time of each stage::
+
+    PYTHONPATH=./src python3 benchmarks/run.py -o bench.json
+    PYTHONPATH=./src python3 benchmarks/run.py --compare bench.json
+
+With --compare, the results are compared with a previous run, and the exit
+status is 1 if a stage got slower than the threshold.
+
+"""
+import argparse
+import glob
+import json
+import os.path
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic
+
+from cc2olx import olx
+from cc2olx.models import Cartridge
+from cc2olx.settings import Config
+
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+STAGES = ["load", "normalize", "export", "tar"]
+
+
+def run_stages(path, workspace):
+    """
+    Run the pipeline once on the cartridge at `path`, timing each stage.
+    """
+    times = {}
+    config = Config(workspace=workspace)
+
+    def timed(stage, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        times[stage] = time.perf_counter() - start
+        return result
+
+    cartridge = Cartridge(path, config)
+    timed("load", cartridge.load)
+    timed("normalize", cartridge.normalize)
+    course_directory = os.path.join(cartridge.directory + "-olx", "course")
+    timed("export", olx.OlxExport(cartridge).write_course, olx.CourseDirectory(course_directory))
+    timed("tar", olx.directory_tar_gz, cartridge.directory + ".tar.gz", course_directory, "course")
+    return times
+
+
+def benchmark(path, repeat):
+    """
+    Run the pipeline `repeat` times on `path`, and keep the best time of each stage.
+    """
+    best = {}
+    with tempfile.TemporaryDirectory() as workspace:
+        for _ in range(repeat):
+            try:
+                times = run_stages(path, workspace)
+            except Exception as exc:
+                return {"error": "{}: {}".format(type(exc).__name__, exc)}
+            for stage, elapsed in times.items():
+                best[stage] = min(elapsed, best.get(stage, elapsed))
+    best["total"] = sum(best.values())
+    return best
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, universal_newlines=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous, threshold):
+    """
+    Print how `results` compare with `previous`, and return the regressions.
+    """
+    regressions = []
+    for name, stages in results["cartridges"].items():
+        old_stages = previous["cartridges"].get(name)
+        if not old_stages or "error" in stages or "error" in old_stages:
+            continue
+        for stage in STAGES + ["total"]:
+            new, old = stages.get(stage), old_stages.get(stage)
+            if not new or not old:
+                continue
+            ratio = new / old
+            flag = ""
+            if ratio > 1 + threshold:
+                flag = "  SLOWER"
+                regressions.append((name, stage, ratio))
+            elif ratio < 1 - threshold:
+                flag = "  faster"
+            print("{:40} {:10} {:9.4f}s -> {:9.4f}s  x{:.2f}{}".format(name, stage, old, new, ratio, flag))
+    return regressions
+
+
+def print_results(results):
+    print("{:40} ".format("cartridge") + " ".join("{:>10}".format(stage) for stage in STAGES + ["total"]))
+    for name, stages in results["cartridges"].items():
+        if "error" in stages:
+            print("{:40} {}".format(name, stages["error"]))
+            continue
+        print("{:40} ".format(name) + " ".join(
+            "{:10.4f}".format(stages.get(stage, 0)) for stage in STAGES + ["total"]
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the cc2olx pipeline.")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Runs per cartridge; the best is kept.")
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file.")
+    parser.add_argument("-c", "--compare", help="Compare with the results in this JSON file.")
+    parser.add_argument("-t", "--threshold", type=float, default=0.2, help="Slowdown counted as a regression.")
+    parser.add_argument("--no-synthetic", action="store_true", help="Only benchmark the test_data cartridges.")
+    parser.add_argument("--presets", nargs="*", default=sorted(synthetic.PRESETS), help="Synthetic presets to run.")
+    args = parser.parse_args()
+
+    results = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "cartridges": {},
+    }
+    with tempfile.TemporaryDirectory() as synthetic_dir:
+        paths = sorted(glob.glob(os.path.join(ROOT, "test_data", "*.imscc")))
+        if not args.no_synthetic:
+            for preset in args.presets:
+                path = os.path.join(synthetic_dir, "synthetic-{}.imscc".format(preset))
+                synthetic.make_cartridge(path, **synthetic.PRESETS[preset])
+                paths.append(path)
+        for path in paths:
+            name = os.path.basename(path)
+            print("Benchmarking", name, file=sys.stderr)
+            results["cartridges"][name] = benchmark(path, args.repeat)
+
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=4)
+    if args.compare:
+        with open(args.compare) as previous_file:
+            previous = json.load(previous_file)
+        print()
+        print("Compared with {}:".format(previous.get("commit")))
+        regressions = compare(results, previous, args.threshold)
+        if regressions:
+            print("{} regression(s) over {:.0%}".format(len(regressions), args.threshold))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
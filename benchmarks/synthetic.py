@@ -0,0 +1,182 @@
+"""
+Generate synthetic Common Cartridge files, to benchmark the converter on
+courses much bigger than the ones in test_data.
+
+    python3 benchmarks/synthetic.py --items 20000 --depth 4 out.imscc
+
+"""
+import argparse
+import random
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+
+NS = "http://www.imsglobal.org/xsd/imsccv1p1/imscp_v1p1"
+LOM_NS = "http://ltsc.ieee.org/xsd/imsccv1p1/LOM/manifest"
+WL_NS = "http://www.imsglobal.org/xsd/imsccv1p1/imswl_v1p1"
+
+# Presets for the benchmark suite: name -> make_cartridge arguments.
+PRESETS = {
+    'wide': dict(items=20000, depth=3, html_size=2000),
+    'deep': dict(items=2000, depth=200, html_size=2000),
+    'big-html': dict(items=100, depth=3, html_size=1024 * 1024),
+}
+
+PARAGRAPH = (
+    "<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do "
+    "eiusmod tempor incididunt ut labore et dolore magna aliqua.  "
+    "<img src=\"$IMS-CC-FILEBASE$/images/image{image}.png\"/></p>\n"
+)
+
+
+def make_html(number, size, images):
+    paragraphs = []
+    length = 0
+    while length < size:
+        paragraph = PARAGRAPH.format(image=(number + len(paragraphs)) % images)
+        paragraphs.append(paragraph)
+        length += len(paragraph)
+    return "<html><body><h1>Page {}</h1>\n{}</body></html>\n".format(number, "".join(paragraphs))
+
+
+def make_weblink(number):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<webLink xmlns="{ns}"><title>Link {number}</title>'
+        '<url href="https://www.youtube.com/watch?v=video{number}"/></webLink>\n'
+    ).format(ns=WL_NS, number=number)
+
+
+def make_tree(items, depth, fanout):
+    """
+    Build an organization tree with `items` leaves, `depth` levels deep.
+
+    Returns nested lists: a leaf is None, a container is a list of children.
+    Leaves are grouped `fanout` at a time; once a level is down to a single
+    container, the remaining levels wrap it in a chain of single-child
+    containers, so very deep trees end up as a long chain over a wide one.
+
+    """
+    leaves = [None] * items
+    level = leaves
+    for _ in range(depth - 1):
+        if len(level) <= 1:
+            level = [level]
+            continue
+        level = [level[i:i + fanout] for i in range(0, len(level), fanout)]
+    return level
+
+
+def make_cartridge(path, items=1000, depth=3, html_size=2000, reuse=0.2, images=50, seed=0):
+    """
+    Write a synthetic cartridge to `path`.
+
+    It has `items` leaf items in an organization `depth` levels deep.  Most
+    leaves are HTML pages of about `html_size` characters, referring to
+    `images` shared images; some are YouTube web links.  A fraction `reuse` of
+    the leaves point to a resource already used by another leaf.
+
+    """
+    rng = random.Random(seed)
+    fanout = max(2, round(items ** (1.0 / max(depth - 1, 1))))
+    tree = make_tree(items, depth, fanout)
+    resources = []
+    items_xml = []
+    count = 0
+    # Deep trees would overflow the recursion limit: walk with a stack.
+    stack = [("open", tree, "      ")]
+    while stack:
+        action, node, indent = stack.pop()
+        if action == "close":
+            items_xml.append("{}</item>\n".format(indent))
+            continue
+        count += 1
+        if node is not None:
+            items_xml.append('{}<item identifier="item{}"><title>Container {}</title>\n'.format(
+                indent, count, count,
+            ))
+            stack.append(("close", None, indent))
+            stack.extend(("open", child, indent + " ") for child in reversed(node))
+            continue
+        if resources and rng.random() < reuse:
+            resource = rng.choice(resources)
+        else:
+            resource = "res{}".format(len(resources))
+            resources.append(resource)
+        items_xml.append('{}<item identifier="item{}" identifierref="{}"><title>Item {}</title></item>\n'.format(
+            indent, count, resource, count,
+        ))
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as cartridge:
+        resources_xml = []
+        for number, identifier in enumerate(resources):
+            if number % 10 == 9:
+                href = "links/{}.xml".format(identifier)
+                cartridge.writestr(href, make_weblink(number))
+                res_type = "imswl_xmlv1p1"
+            else:
+                href = "wiki_content/{}.html".format(identifier)
+                cartridge.writestr(href, make_html(number, html_size, images))
+                res_type = "webcontent"
+            resources_xml.append(
+                '    <resource identifier="{}" type="{}" href={}><file href={}/></resource>\n'.format(
+                    identifier, res_type, quoteattr(href), quoteattr(href),
+                )
+            )
+        for image in range(images):
+            href = "web_resources/images/image{}.png".format(image)
+            cartridge.writestr(href, bytes(rng.getrandbits(8) for _ in range(1024)))
+            resources_xml.append(
+                '    <resource identifier="img{}" type="webcontent" href={}><file href={}/></resource>\n'.format(
+                    image, quoteattr(href), quoteattr(href),
+                )
+            )
+        manifest = (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<manifest identifier="synthetic" xmlns="{ns}" xmlns:lomimscc="{lom}">\n'
+            '  <metadata>\n'
+            '    <schema>IMS Common Cartridge</schema>\n'
+            '    <schemaversion>1.1.0</schemaversion>\n'
+            '    <lomimscc:lom><lomimscc:general><lomimscc:title><lomimscc:string>{title}</lomimscc:string>'
+            '</lomimscc:title></lomimscc:general></lomimscc:lom>\n'
+            '  </metadata>\n'
+            '  <organizations>\n'
+            '    <organization identifier="org_1" structure="rooted-hierarchy">\n'
+            '{items}'
+            '    </organization>\n'
+            '  </organizations>\n'
+            '  <resources>\n'
+            '{resources}'
+            '  </resources>\n'
+            '</manifest>\n'
+        ).format(
+            ns=NS,
+            lom=LOM_NS,
+            title=escape("Synthetic course: {} items, depth {}".format(items, depth)),
+            items="".join(items_xml),
+            resources="".join(resources_xml),
+        )
+        cartridge.writestr("imsmanifest.xml", manifest)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Common Cartridge file.")
+    parser.add_argument("output", help="The .imscc file to write.")
+    parser.add_argument("--items", type=int, default=1000, help="Number of leaf items.")
+    parser.add_argument("--depth", type=int, default=3, help="Depth of the organization tree.")
+    parser.add_argument("--html-size", type=int, default=2000, help="Approximate size of HTML pages.")
+    parser.add_argument("--reuse", type=float, default=0.2, help="Fraction of items reusing a resource.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    make_cartridge(
+        args.output,
+        items=args.items,
+        depth=args.depth,
+        html_size=args.html_size,
+        reuse=args.reuse,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+A content-addressed cache of conversion results, kept in the workspace.
+
+Cartridges are identified by the SHA-256 of their contents, and resources by
+the CRC32 and size the zip records for each of their files.  Entries are kept
+under a digest of the converter's own source files, so any change to the
+converter invalidates everything, and `ConversionCache.prune` removes them.
+
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from cc2olx import filesystem
+from cc2olx.qti import ASSESSMENT_TYPES
+
+
+CACHE_DIRECTORY = '.cache'
+HASH_CHUNK_SIZE = 1024 * 1024
+# The digests of input files, which don't depend on the converter.
+STATS_DIRECTORY = 'stats'
+# The resources whose conversions are cached: those parsed from XML.  Pages
+# and static files are read as they are, faster than from the cache.
+CACHED_RESOURCE_TYPES = ('imswl_xmlv1p1', 'imsbasiclti_xmlv1p0') + ASSESSMENT_TYPES
+
+
+def _code_version():
+    """
+    Get a digest of the source files of the cc2olx package.
+    """
+    digest = hashlib.sha256()
+    package = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(package)):
+        if name.endswith('.py'):
+            digest.update(name.encode('utf8'))
+            with open(os.path.join(package, name), 'rb') as source:
+                digest.update(source.read())
+    return digest.hexdigest()
+
+
+# Identifies the code of the converter: names the directory of the entries.
+CODE_VERSION = _code_version()
+
+
+class ConversionCache:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def __repr__(self):
+        return "<ConversionCache directory={directory} />".format(
+            directory=self.directory,
+        )
+
+    def cartridge_key(self, source, config):
+        """
+        Get the key of the conversion of `source` (a path) with `config`.
+        """
+        parts = [
+            self.file_digest(source),
+            config.output_format,
+            str(config.compresslevel),
+        ]
+        return _hash_text("\n".join(parts))
+
+    def file_digest(self, path):
+        """
+        Get the SHA-256 of the file at `path`.
+
+        Digests are remembered with the size and modification time of the
+        file, so unchanged files aren't read again.
+
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        stat_path = os.path.join(self.directory, STATS_DIRECTORY, _hash_text(path) + '.json')
+        known = self._read_json(stat_path)
+        if known and known['signature'] == signature:
+            return known['digest']
+        digest = hashlib.sha256()
+        with open(path, 'rb') as source:
+            for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        self._write_json(stat_path, {'signature': signature, 'digest': digest})
+        return digest
+
+    def get_output(self, key):
+        """
+        Get the path and report of the cached output for `key`, or None.
+
+        The output is a file or a directory, see `Config.output_format`.
+
+        """
+        output = self._path('outputs', key)
+        report = self._read_json(output + '.json')
+        if report is None or not os.path.exists(output):
+            return None
+        return output, report
+
+    def put_output(self, key, output, report):
+        cached = self._path('outputs', key)
+        filesystem.create_directory(os.path.dirname(cached))
+        _atomic_copy(output, cached)
+        self._write_json(cached + '.json', report)
+
+    def prune(self):
+        """
+        Remove the entries written by other versions of the converter.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name not in (STATS_DIRECTORY, CODE_VERSION):
+                path = os.path.join(self.directory, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+
+    def resource_key(self, cartridge, resource):
+        """
+        Get the key of `resource` in `cartridge`, or None if it isn't cached.
+
+        The key covers the files of the resource, and of the resources it
+        depends on: its dependencies, and the question banks of assessments.
+
+        """
+        if resource is None or resource.type not in CACHED_RESOURCE_TYPES:
+            return None
+        parts = [resource.type]
+        seen = set()
+        stack = [resource]
+        while stack:
+            res = stack.pop()
+            if res.identifier in seen:
+                continue
+            seen.add(res.identifier)
+            parts.append("resource {}".format(res.identifier))
+            identifiers = [
+                child.identifierref
+                for child in res.children
+                if getattr(child, 'identifierref', None) is not None
+            ]
+            if res.type in ASSESSMENT_TYPES:
+                identifiers.extend(cartridge.qti_parser.get_bank_references(res))
+            for identifier in identifiers:
+                dependency = cartridge.resources_by_id.get(identifier)
+                if dependency is None:
+                    parts.append("missing {}".format(identifier))
+                else:
+                    stack.append(dependency)
+            for res_file in res.children:
+                href = getattr(res_file, 'href', None)
+                if href is None:
+                    continue
+                try:
+                    info = cartridge.res_info(href)
+                except KeyError:
+                    return None
+                parts.append("{} {} {}".format(href, info.CRC, info.file_size))
+        return _hash_text("\n".join(parts))
+
+    def get_resource(self, key):
+        content = self._read_json(self._path('resources', key[:2], key + '.json'))
+        if content is None:
+            return None
+        return tuple(content)
+
+    def put_resource(self, key, content):
+        self._write_json(self._path('resources', key[:2], key + '.json'), content)
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, CODE_VERSION, *parts)
+
+    def _read_json(self, path):
+        try:
+            with open(path) as json_file:
+                return json.load(json_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_json(self, path, data):
+        filesystem.create_directory(os.path.dirname(path))
+        # Write then rename, so that parallel conversions never see half a file.
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path), delete=False) as temp:
+            json.dump(data, temp)
+        os.replace(temp.name, path)
+
+
+def _hash_text(text):
+    return hashlib.sha256(text.encode('utf8')).hexdigest()
+
+
+def _atomic_copy(source, destination):
+    if os.path.isdir(source):
+        temp = tempfile.mkdtemp(dir=os.path.dirname(destination))
+        shutil.copytree(source, temp, dirs_exist_ok=True)
+        shutil.rmtree(destination, ignore_errors=True)
+        os.replace(temp, destination)
+        return
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(destination), delete=False) as temp:
+        with open(source, 'rb') as source_file:
+            shutil.copyfileobj(source_file, temp)
+    os.replace(temp.name, destination)
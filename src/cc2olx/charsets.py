@@ -0,0 +1,101 @@
+"""
+Detect the encoding of HTML files, and transcode them to UTF-8.
+
+Detection only looks at the start of a file: a byte order mark, then a
+<meta> charset declaration, then whether it decodes as UTF-8.  Files already
+in UTF-8, the common case, are used as they are, without decoding them.
+
+"""
+import codecs
+import re
+
+
+UTF8 = 'utf-8'
+# How much of the start of a file is looked at to detect its encoding.
+SNIFF_SIZE = 4096
+# The encoding of files that declare none and aren't UTF-8, as browsers guess.
+FALLBACK_ENCODING = 'cp1252'
+# Byte order marks, longest first since the UTF-32 ones start like the UTF-16 ones.
+BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+# Declared encodings that browsers read as another, by Python codec name:
+# Latin-1 as its superset cp1252, and ASCII, often declared by pages that
+# aren't, as if nothing was declared (None).
+DECLARED_ENCODINGS = {
+    'iso8859-1': 'cp1252',
+    'ascii': None,
+}
+# <meta charset="..."> and <meta http-equiv="Content-Type" content="...; charset=...">.
+META_CHARSET_RE = re.compile(rb"<meta\s[^>]*charset\s*=\s*[\"']?\s*([\w.:-]+)", re.IGNORECASE)
+
+
+def detect_encoding(head):
+    """
+    Detect the encoding of an HTML file, from `head`, its first bytes.
+
+    Returns the name of a Python codec: 'utf-8' for files that can be used
+    as they are.
+
+    """
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+    head = head[:SNIFF_SIZE]
+    match = META_CHARSET_RE.search(head)
+    if match:
+        try:
+            encoding = codecs.lookup(match.group(1).decode('ascii')).name
+        except LookupError:
+            encoding = None
+        encoding = DECLARED_ENCODINGS.get(encoding, encoding)
+        # A file that can declare its encoding in ASCII isn't UTF-16 or UTF-32.
+        if encoding is not None and not encoding.startswith(('utf-16', 'utf-32')):
+            return encoding
+    try:
+        # The end of `head` may cut a character in two: don't check it.
+        codecs.getincrementaldecoder(UTF8)().decode(head)
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+    return UTF8
+
+
+def iter_utf8(chunks):
+    """
+    Transcode the bytes of an HTML file, read as `chunks`, to UTF-8.
+
+    The encoding is detected from the first chunk.  UTF-8 chunks are passed
+    through; others are decoded and encoded as they come, replacing the
+    bytes that can't be decoded.
+
+    """
+    chunks = iter(chunks)
+    first = next(chunks, b'')
+    encoding = detect_encoding(first)
+    if encoding == UTF8:
+        yield first
+        yield from chunks
+        return
+    if encoding == 'utf-8-sig':
+        yield first[len(codecs.BOM_UTF8):]
+        yield from chunks
+        return
+    decoder = codecs.getincrementaldecoder(encoding)('replace')
+    yield decoder.decode(first).encode(UTF8)
+    for chunk in chunks:
+        yield decoder.decode(chunk).encode(UTF8)
+    yield decoder.decode(b'', final=True).encode(UTF8)
+
+
+def to_utf8(data):
+    """
+    Transcode the bytes of a whole HTML file to UTF-8, see `iter_utf8`.
+
+    UTF-8 files are returned as they are, without copying them.
+
+    """
+    return b''.join(iter_utf8([data]))
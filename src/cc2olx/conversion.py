@@ -0,0 +1,117 @@
+"""
+Convert Common Cartridge files to OLX, as a library.
+"""
+import json
+import logging
+import os.path
+import time
+import traceback
+
+from cc2olx import filesystem
+from cc2olx import olx
+from cc2olx.cache import CACHE_DIRECTORY, ConversionCache
+from cc2olx.instrumentation import Profile
+from cc2olx.models import Cartridge
+from cc2olx.settings import Config
+
+logger = logging.getLogger()
+
+
+def convert(source, output=None, config=None):
+    """
+    Convert the cartridge `source` to an OLX course.
+
+    `source` is the path of an .imscc file, or a binary file object opened on
+    one.  `config` is a `Config`, whose `output_format` says what to write:
+    a tarball, or an OLX directory (see `olx.OUTPUT_WRITERS`).  `output` is
+    its path: by default, it goes in the workspace, named after the
+    cartridge.  An existing directory is only replaced by a new one when it
+    holds an OLX course, see `olx.FolderOutput`.
+
+    Returns a report: a dict describing the conversion.  Errors are raised.
+
+    With `config.cache`, a cartridge converted before with the same content
+    and settings isn't converted again: the previous output is copied, and
+    the report says 'cached'.
+
+    """
+    config = config or Config()
+    start = time.time()
+    filesystem.create_directory(config.workspace)
+    cartridge = Cartridge(source, config)
+    try:
+        writer = olx.get_output_writer(config)
+        if output is None:
+            output = writer.default_path(cartridge.get_workspace_directory())
+        cache = key = None
+        if config.cache and isinstance(source, str):
+            cache = ConversionCache(os.path.join(config.workspace, CACHE_DIRECTORY))
+            cache.prune()
+            key = cache.cartridge_key(source, config)
+            cached = cache.get_output(key)
+            if cached is not None:
+                cached_output, report = cached
+                writer.copy(cached_output, output)
+                # The profile measured the conversion that filled the cache.
+                report.pop('profile', None)
+                report.update({
+                    'input_file': cartridge.file_path,
+                    'output': output,
+                    'elapsed': time.time() - start,
+                    'cached': True,
+                })
+                return report
+            cartridge.conversion_cache = cache
+        if config.profile:
+            cartridge.profile = Profile()
+        profile = cartridge.profile
+        cartridge.load()
+        with profile.phase('normalize'):
+            cartridge.normalize()
+        writer.write(olx.OlxExport(cartridge), output)
+        logger.debug("Resource cache: %r", cartridge.resource_cache)
+        cartridge.diagnostics.log_summary()
+        report = {
+            'input_file': cartridge.file_path,
+            'output': output,
+            'title': cartridge.get_title(),
+            'error': None,
+            'elapsed': time.time() - start,
+            'resource_cache': {
+                'hits': cartridge.resource_cache.hits,
+                'misses': cartridge.resource_cache.misses,
+            },
+            'profile': profile.report(),
+            'diagnostics': cartridge.diagnostics.summary(),
+            'cached': False,
+        }
+        if cache is not None:
+            cache.put_output(key, output, report)
+        if config.profile:
+            with open(cartridge.directory + "-profile.json", "w") as profile_file:
+                json.dump(report, profile_file, indent=4)
+        return report
+    finally:
+        cartridge.profile.stop()
+        cartridge.close()
+
+
+def safe_convert(source, output=None, config=None):
+    """
+    Like `convert`, but report errors instead of raising them.
+
+    When the conversion fails, the report's 'error' is the formatted
+    traceback.
+
+    """
+    start = time.time()
+    try:
+        return convert(source, output, config)
+    except Exception:
+        report = {
+            'input_file': source if isinstance(source, str) else getattr(source, 'name', None),
+            'output': output,
+            'error': traceback.format_exc(),
+            'elapsed': time.time() - start,
+        }
+        return report
@@ -0,0 +1,142 @@
+"""
+Collect and log the problems found in cartridges.
+
+Problems are reported as events to the `Diagnostics` of each cartridge,
+which counts them and only logs the first few of each kind.  Logging goes
+through a queue to a separate thread, so conversions never wait on output.
+
+"""
+import logging
+import logging.handlers
+import multiprocessing
+import sys
+import threading
+
+logger = logging.getLogger()
+
+# How many distinct events of each kind are logged per cartridge, and kept
+# as examples in the summary.
+LOG_LIMIT = 10
+
+MESSAGES = {
+    'missing_resource': "Missing resource: {identifier}",
+    'missing_static_file': "Missing static file: {href}",
+    'unimported_content': "Unimported content: type = {type!r}, href = {href!r}",
+    'unreadable_resource': "Failure reading {href!r} from id {identifier}",
+    'unsupported_resource_element': "Unsupported resource element: {tag}",
+}
+
+
+class Diagnostics:
+    """
+    Count the events reported while reading one cartridge.
+
+    An event has a kind, one of `MESSAGES`, and details.  Events with the
+    same details are all counted but only logged once, and at most
+    `log_limit` distinct events of each kind are logged.  Events can be
+    reported from several threads.
+
+    """
+    def __init__(self, name, log_limit=LOG_LIMIT):
+        self.name = name
+        self.log_limit = log_limit
+        # Maps each kind to a dict counting each distinct set of details.
+        self.events = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<Diagnostics name={name} events={events} />".format(
+            name=self.name,
+            events=sum(sum(counts.values()) for counts in self.events.values()),
+        )
+
+    def event(self, kind, **details):
+        self._count(kind, tuple(sorted(details.items())), 1)
+
+    def merge(self, events):
+        """
+        Count the `events` of another `Diagnostics`, logging them like `event`.
+
+        Used to gather the events of the processes exporting chapters in
+        parallel, in the order of the chapters.
+
+        """
+        for kind, counts in events.items():
+            for key, count in counts.items():
+                self._count(kind, key, count)
+
+    def _count(self, kind, key, count):
+        with self._lock:
+            counts = self.events.setdefault(kind, {})
+            first = key not in counts
+            counts[key] = counts.get(key, 0) + count
+            log = first and len(counts) <= self.log_limit
+        if log:
+            details = dict(key)
+            logger.warning(
+                "%s: %s",
+                self.name,
+                MESSAGES[kind].format(**details),
+                extra={'diagnostic': kind, 'details': details},
+                stacklevel=3,
+            )
+
+    def log_summary(self):
+        """
+        Log how many distinct events of each kind were not logged.
+        """
+        for kind, counts in self.events.items():
+            if len(counts) > self.log_limit:
+                logger.warning(
+                    "%s: %d more distinct %s events not logged",
+                    self.name,
+                    len(counts) - self.log_limit,
+                    kind,
+                )
+
+    def summary(self):
+        """
+        Get the counts of events, as a dict that can be dumped as JSON.
+
+        For each kind: the number of events, the number of distinct ones,
+        and the details of the first few.
+
+        """
+        summary = {}
+        with self._lock:
+            for kind, counts in self.events.items():
+                summary[kind] = {
+                    'count': sum(counts.values()),
+                    'distinct': len(counts),
+                    'examples': [dict(key) for key in list(counts)[:self.log_limit]],
+                }
+        return summary
+
+
+def start_logging(level, format, stream=None):
+    """
+    Log to `stream` (stderr by default) from a separate thread.
+
+    Records are put on a queue by a `QueueHandler` on the root logger, and
+    written by a `QueueListener`.  The queue can be shared with the
+    processes of a pool: see `use_log_queue`.
+
+    Returns the queue and the listener, to stop at the end.
+
+    """
+    log_queue = multiprocessing.Queue(-1)
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(logging.Formatter(format))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    use_log_queue(log_queue, level)
+    listener.start()
+    return log_queue, listener
+
+
+def use_log_queue(log_queue, level):
+    """
+    Send the records of this process to `log_queue`.
+    """
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(level)
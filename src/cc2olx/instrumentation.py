@@ -0,0 +1,142 @@
+"""
+Measure where the time and memory of conversions go.
+"""
+import contextlib
+import threading
+import time
+import tracemalloc
+
+
+class Profile:
+    """
+    Record the wall time, CPU time and peak memory of conversion phases.
+
+    Phases can be nested: the peak memory of a phase includes the peaks of
+    the phases inside it.  The time spent reading each type of resource is
+    recorded too, with `resource`.
+
+    Memory is measured with `tracemalloc`, which is started if needed, and
+    slows Python down: only profile when you need the numbers, and `stop`
+    the profile when done.
+
+    """
+    def __init__(self):
+        self.phases = {}
+        self.resource_types = {}
+        # Resources can be read from several threads at once.
+        self._resource_lock = threading.Lock()
+        # Peak memory seen so far by each of the phases being measured.
+        self._peaks = []
+        # Whether tracing was started here, and so is to be stopped here.
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if self._peaks:
+            self._peaks[-1] = max(self._peaks[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self._peaks.append(0)
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+            peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            stats = self.phases.setdefault(name, _new_stats())
+            stats['calls'] += 1
+            stats['wall'] += wall
+            stats['cpu'] += cpu
+            stats['peak_memory'] = max(stats['peak_memory'], peak)
+
+    @contextlib.contextmanager
+    def resource(self, res_type):
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+            with self._resource_lock:
+                stats = self.resource_types.setdefault(res_type, _new_stats())
+                stats['calls'] += 1
+                stats['wall'] += wall
+                stats['cpu'] += cpu
+
+    def report(self):
+        """
+        Get the measurements, as a dict that can be dumped as JSON.
+        """
+        return {
+            'phases': self.phases,
+            'resource_types': self.resource_types,
+        }
+
+    def stop(self):
+        """
+        Stop measuring memory, unless it was already measured before this profile.
+        """
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+
+class NullProfile:
+    """
+    A `Profile` that measures nothing, used when profiling is off.
+    """
+    def phase(self, name):
+        return contextlib.nullcontext()
+
+    def resource(self, res_type):
+        return contextlib.nullcontext()
+
+    def report(self):
+        return None
+
+    def stop(self):
+        pass
+
+
+NULL_PROFILE = NullProfile()
+
+
+def _new_stats():
+    return {
+        'calls': 0,
+        'wall': 0.0,
+        'cpu': 0.0,
+        'peak_memory': 0,
+    }
+
+
+def aggregate(reports):
+    """
+    Combine the `Profile.report`s of several conversions.
+
+    Times and calls are summed, peak memory is the largest peak.
+
+    """
+    total = {
+        'count': 0,
+        'phases': {},
+        'resource_types': {},
+    }
+    for report in reports:
+        if not report:
+            continue
+        total['count'] += 1
+        for section in ('phases', 'resource_types'):
+            for name, stats in report[section].items():
+                total_stats = total[section].setdefault(name, _new_stats())
+                total_stats['calls'] += stats['calls']
+                total_stats['wall'] += stats['wall']
+                total_stats['cpu'] += stats['cpu']
+                total_stats['peak_memory'] = max(total_stats['peak_memory'], stats['peak_memory'])
+    return total
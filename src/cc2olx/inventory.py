@@ -0,0 +1,159 @@
+"""
+Take the inventory of cartridges, without converting them.
+
+Only the manifest and the zip directory of each cartridge are read, so an
+inventory is much faster than a conversion, and tells what a conversion
+would run into.
+
+"""
+import collections
+import csv
+import dataclasses
+import time
+import traceback
+
+from cc2olx.models import Cartridge, ResourceFile, SUPPORTED_RESOURCE_TYPES
+from cc2olx.settings import Config
+
+
+CSV_FIELDS = [
+    'input_file',
+    'title',
+    'version',
+    'items',
+    'depth',
+    'resources',
+    'html_size',
+    'missing_resources',
+    'missing_files',
+    'unsupported_types',
+    'resource_types',
+    'error',
+    'elapsed',
+]
+
+
+def inventory(source, config=None):
+    """
+    Describe the content of the cartridge `source`, a path or binary file.
+
+    Returns a report: a dict with the counts of resources by type, the
+    unsupported types used by items, the items referring to missing
+    resources, the files missing from the archive, the total size of the
+    HTML pages, and the number of items and depth of the organizations.
+    Errors are raised.
+
+    """
+    start = time.time()
+    # Read the manifest from the archive, even when conversions extract it.
+    config = dataclasses.replace(config or Config(), extract=False)
+    with Cartridge(source, config) as cartridge:
+        resources_by_id = cartridge.resources_by_id
+        items, depth, identifierrefs = _walk_organizations(cartridge.organizations)
+
+        missing_resources = sorted(identifierrefs - resources_by_id.keys())
+        unsupported_types = collections.Counter(
+            resources_by_id[identifierref].type
+            for identifierref in identifierrefs & resources_by_id.keys()
+            if resources_by_id[identifierref].type not in SUPPORTED_RESOURCE_TYPES
+        )
+
+        file_sizes = {info.filename: info.file_size for info in cartridge.cartridge.infolist()}
+        seen = set()
+        missing_files = []
+        html_size = 0
+        for resource in cartridge.resources:
+            for res_file in resource.children:
+                if not isinstance(res_file, ResourceFile) or res_file.href in seen:
+                    continue
+                href = res_file.href
+                seen.add(href)
+                if href not in file_sizes:
+                    missing_files.append(href)
+                elif resource.type == 'webcontent' and href.endswith('.html'):
+                    html_size += file_sizes[href]
+
+        return {
+            'input_file': cartridge.file_path,
+            'title': cartridge.get_title(),
+            'version': cartridge.version,
+            'items': items,
+            'depth': depth,
+            'resources': len(cartridge.resources),
+            'resource_types': dict(collections.Counter(
+                resource.type for resource in cartridge.resources
+            )),
+            'unsupported_types': dict(unsupported_types),
+            'missing_resources': missing_resources,
+            'missing_files': sorted(missing_files),
+            'html_size': html_size,
+            'diagnostics': cartridge.diagnostics.summary(),
+            'error': None,
+            'elapsed': time.time() - start,
+        }
+
+
+def safe_inventory(source, config=None):
+    """
+    Like `inventory`, but report errors instead of raising them.
+    """
+    start = time.time()
+    try:
+        return inventory(source, config)
+    except Exception:
+        return {
+            'input_file': source if isinstance(source, str) else getattr(source, 'name', None),
+            'error': traceback.format_exc(),
+            'elapsed': time.time() - start,
+        }
+
+
+def _walk_organizations(organizations):
+    """
+    Count the leaf items and the depth of `organizations`.
+
+    Returns the number of leaves, the depth of the deepest item (items
+    directly in an organization are at depth 1), and the set of the
+    identifierrefs of the items.
+
+    """
+    items = 0
+    depth = 0
+    identifierrefs = set()
+    stack = [(child, 1) for organization in organizations for child in organization.children]
+    while stack:
+        item, level = stack.pop()
+        depth = max(depth, level)
+        if item.identifierref is not None:
+            items += 1
+            identifierrefs.add(item.identifierref)
+        stack.extend((child, level + 1) for child in item.children)
+    return items, depth, identifierrefs
+
+
+def write_csv(reports, output):
+    """
+    Write `reports` to the text stream `output` as CSV, one row per cartridge.
+
+    Lists are written as their length, and counts by type as
+    "type=count" pairs separated by semicolons.
+
+    """
+    writer = csv.DictWriter(output, CSV_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for report in reports:
+        row = dict(report)
+        for field in ('missing_resources', 'missing_files'):
+            if field in row:
+                row[field] = len(row[field])
+        for field in ('unsupported_types', 'resource_types'):
+            if field in row:
+                row[field] = ';'.join(
+                    '{}={}'.format(res_type, count)
+                    for res_type, count in sorted(row[field].items(), key=lambda pair: str(pair[0]))
+                )
+        if 'elapsed' in row:
+            row['elapsed'] = '{:.3f}'.format(row['elapsed'])
+        if row.get('error'):
+            row['error'] = row['error'].strip().splitlines()[-1]
+        writer.writerow(row)
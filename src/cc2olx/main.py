@@ -1,42 +1,187 @@
+import concurrent.futures
+import json
 import logging
 import os.path
+import sys
+import time
 import traceback
 
 from cc2olx.settings import collect_settings
-from cc2olx import filesystem
-from cc2olx import models
-from cc2olx.models import Cartridge
-from cc2olx import olx
-
-
-def convert_one_file(settings, input_file):
-    print("Converting", input_file)
-    workspace = settings['workspace']
-    filesystem.create_directory(workspace)
-    cartridge = Cartridge(input_file)
-    data = cartridge.load_manifest_extracted()
-    cartridge.load_course_settings_extracted()
-    cartridge.normalize()
-    # print()
-    # print("=" * 100)
-    # import json; print(json.dumps(cartridge.normalized, indent=4))
-    xml = olx.OlxExport(cartridge).xml()
-    olx_filename = os.path.join(workspace, cartridge.directory + "-course.xml")
-    with open(olx_filename, "w") as olxfile:
-        olxfile.write(xml)
-    tgz_filename = os.path.join(workspace, cartridge.directory + ".tar.gz")
-    olx.onefile_tar_gz(tgz_filename, xml.encode("utf8"), "course.xml")
+from cc2olx import conversion
+from cc2olx import diagnostics
+from cc2olx import instrumentation
+from cc2olx import inventory
+from cc2olx import worker
+from cc2olx.settings import INVENTORY_FORMAT_CSV
+
+logger = logging.getLogger()
+
+
+def convert_one_file(config, input_file):
+    logger.info("Converting %s", input_file)
+    return conversion.convert(input_file, config=config)
+
+
+def safe_convert_one_file(config, input_file):
+    """
+    Convert one file, without letting a failure escape.
+
+    Returns the report of the conversion: see `conversion.safe_convert`.
+
+    """
+    logger.info("Converting %s", input_file)
+    return conversion.safe_convert(input_file, config=config)
+
+
+def safe_inventory_one_file(config, input_file):
+    """
+    Take the inventory of one file, without letting a failure escape.
+    """
+    return inventory.safe_inventory(input_file, config)
+
+
+def convert_files(settings, log_queue=None):
+    """
+    Convert all the input files, yielding their results in input order.
+    """
+    return process_files(settings, safe_convert_one_file, log_queue)
+
+
+def process_files(settings, function, log_queue=None):
+    """
+    Call `function(config, input_file)` on all the input files, yielding
+    the results in input order.
+
+    With more than one job, the files are processed in a process pool, but
+    results are still produced in the order of `settings['input_files']`.
+    The processes log to `log_queue`, when given: see
+    `diagnostics.start_logging`.
+
+    When a process of the pool dies, killed for using too much memory for
+    example, the file whose result is next is reported as failed, and the
+    files after it are processed again in a new pool.
+
+    """
+    config = settings['config']
+    input_files = settings['input_files']
+    jobs = min(settings['jobs'], len(input_files))
+    if jobs <= 1:
+        for input_file in input_files:
+            yield function(config, input_file)
+        return
+    pool_options = {}
+    if log_queue is not None:
+        pool_options = {
+            'initializer': diagnostics.use_log_queue,
+            'initargs': (log_queue, logging.getLogger().level),
+        }
+    done = 0
+    while done < len(input_files):
+        start = time.time()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, **pool_options) as executor:
+            futures = [
+                executor.submit(function, config, input_file)
+                for input_file in input_files[done:]
+            ]
+            for future in futures:
+                broken = False
+                try:
+                    result = future.result()
+                except concurrent.futures.BrokenExecutor:
+                    broken = True
+                    result = {
+                        'input_file': input_files[done],
+                        'error': traceback.format_exc(),
+                        'elapsed': time.time() - start,
+                    }
+                done += 1
+                yield result
+                if broken:
+                    break
+
+
+def write_inventory(settings, output, log_queue=None):
+    """
+    Write the inventory of all the input files to `output`.
+    """
+    reports = process_files(settings, safe_inventory_one_file, log_queue)
+    if settings['inventory'] == INVENTORY_FORMAT_CSV:
+        inventory.write_csv(reports, output)
+    else:
+        json.dump(list(reports), output, indent=4)
+        output.write("\n")
+
+
+def print_summary(results, elapsed):
+    failures = [result for result in results if result['error']]
+    print(
+        "Converted {ok} of {count} file(s) in {elapsed:.2f}s, {failed} failed.".format(
+            ok=len(results) - len(failures),
+            count=len(results),
+            elapsed=elapsed,
+            failed=len(failures),
+        )
+    )
+    for result in failures:
+        print("    FAILED {}".format(result['input_file']))
 
 
 def main():
     settings = collect_settings()
-    logging.basicConfig(**settings['logging_config'])
-    logger = logging.getLogger()
-    for input_file in settings['input_files']:
-        try:
-            convert_one_file(settings, input_file)
-        except Exception:
-            traceback.print_exc()
+    log_queue, listener = diagnostics.start_logging(**settings['logging_config'])
+    try:
+        run(settings, log_queue)
+    finally:
+        listener.stop()
+
+
+def run(settings, log_queue):
+    if settings['worker']:
+        socket_path = settings['worker']
+        if socket_path == '-':
+            socket_path = None
+        worker.serve(settings['config'], socket_path)
+        return
+    if settings['inventory']:
+        write_inventory(settings, sys.stdout, log_queue)
+        return
+    start = time.time()
+    count = len(settings['input_files'])
+    results = []
+    for number, result in enumerate(convert_files(settings, log_queue), start=1):
+        if result['error']:
+            print(result['error'], end='', file=sys.stderr)
+        print(
+            "[{number}/{count}] {status} {input_file} ({elapsed:.2f}s)".format(
+                number=number,
+                count=count,
+                status='FAILED' if result['error'] else 'OK',
+                input_file=result['input_file'],
+                elapsed=result['elapsed'],
+            )
+        )
+        results.append(result)
+    print_summary(results, time.time() - start)
+    config = settings['config']
+    if config.profile:
+        write_profile(config, results)
+
+
+def write_profile(config, results):
+    """
+    Write the profiles of all the conversions, and their total, as JSON.
+    """
+    profile = {
+        'total': instrumentation.aggregate(result.get('profile') for result in results),
+        'files': {
+            result['input_file']: result.get('profile')
+            for result in results
+        },
+    }
+    profile_filename = os.path.join(config.workspace, "profile.json")
+    with open(profile_filename, "w") as profile_file:
+        json.dump(profile, profile_file, indent=4)
+    print("Profile written to", profile_filename)
 
 
 if __name__ == '__main__':
@@ -1,39 +1,40 @@
+import collections
+import concurrent.futures
 import os.path
 import re
-import tarfile
-from textwrap import dedent
 import zipfile
 
+from xml.etree import ElementTree
+
+from cc2olx import charsets
 from cc2olx import filesystem
-from cc2olx.settings import collect_settings
+from cc2olx.diagnostics import Diagnostics
+from cc2olx.instrumentation import NULL_PROFILE
+from cc2olx.qti import ASSESSMENT_TYPES, QtiParser
+from cc2olx.settings import Config
 from cc2olx.settings import COURSE_SETTINGS, MANIFEST
 
 
 DIFFUSE_SHALLOW_SECTIONS = False
 DIFFUSE_SHALLOW_SUBSECTIONS = True
 
+# Total size, in bytes, of the HTML bodies kept by a `ResourceCache`.
+HTML_CACHE_SIZE = 64 * 1024 * 1024
 
-OLX_DIRECTORIES = [
-    'about',
-    'assets',
-    'chapter',
-    'course',
-    'html',
-    'info',
-    'policies',
-    'problem',
-    'sequential',
-    'static',
-    'vertical',
-]
+# The resource types `Cartridge.load_resource_content` knows how to convert.
+SUPPORTED_RESOURCE_TYPES = (
+    'webcontent',
+    'imswl_xmlv1p1',
+    'imsbasiclti_xmlv1p0',
+) + ASSESSMENT_TYPES
 
 
 def is_leaf(container):
-    return 'identifierref' in container
+    return container.identifierref is not None
 
 
 def has_only_leaves(container):
-    return all(is_leaf(child) for child in container.get('children', []))
+    return all(is_leaf(child) for child in container.children)
 
 
 def pprint(level, key, value, count=0):
@@ -41,14 +42,85 @@ def pprint(level, key, value, count=0):
     text = "{spaces}|--> {key}({count}) {value} {title}".format(
         spaces='    '*level,
         key=key,
-        value=value['identifier'],
+        value=value.identifier,
         count=count,
-        title=value.get('title', 'none'),
+        title=value.title or 'none',
     )
     print(text)
 
 
+class Item:
+    """
+    An item of an organization: a container, or a leaf pointing to a resource.
+
+    Attributes missing from the manifest are None, and `children` is empty
+    for leaves.  Slots keep big organizations compact.
+
+    """
+    __slots__ = ('identifier', 'identifierref', 'title', 'children')
+
+    def __init__(self, identifier=None, identifierref=None, title=None, children=None):
+        self.identifier = identifier
+        self.identifierref = identifierref
+        self.title = title
+        self.children = children if children is not None else []
+
+    def __repr__(self):
+        return "<Item identifier={identifier} identifierref={identifierref} children={count} />".format(
+            identifier=self.identifier,
+            identifierref=self.identifierref,
+            count=len(self.children),
+        )
+
+    def is_empty(self):
+        return not (self.identifier or self.identifierref or self.title or self.children)
+
+
+class Organization:
+    """
+    An organization of the manifest: the root of a tree of `Item`s.
+    """
+    __slots__ = ('identifier', 'structure', 'children')
+
+    def __init__(self, identifier=None, structure=None, children=None):
+        self.identifier = identifier
+        self.structure = structure
+        self.children = children if children is not None else []
+
+    def __repr__(self):
+        return "<Organization identifier={identifier} children={count} />".format(
+            identifier=self.identifier,
+            count=len(self.children),
+        )
+
+
+class Resource:
+    """
+    A resource of the manifest.
+
+    `children` holds its `ResourceFile`s and `ResourceDependency`s, in
+    manifest order.
+
+    """
+    __slots__ = ('identifier', 'type', 'href', 'intended_use', 'children')
+
+    def __init__(self, identifier=None, type=None, href=None, intended_use=None, children=None):
+        self.identifier = identifier
+        self.type = type
+        self.href = href
+        self.intended_use = intended_use
+        self.children = children if children is not None else []
+
+    def __repr__(self):
+        return "<Resource identifier={identifier} type={type} />".format(
+            identifier=self.identifier,
+            type=self.type,
+        )
+
+
 class ResourceFile:
+    __slots__ = ('href',)
+
     def __init__(self, href):
         self.href = href
 
@@ -59,6 +131,8 @@ class ResourceFile:
 
 
 class ResourceDependency:
+    __slots__ = ('identifierref',)
+
     def __init__(self, identifierref):
         self.identifierref = identifierref
 
@@ -68,20 +142,159 @@ class ResourceDependency:
         )
 
 
+class ResourceCache:
+    """
+    Memoize the contents of resources by identifier.
+
+    HTML bodies can be big, so they are kept in an LRU bounded by their total
+    size.  Other contents are small, and are kept for the whole conversion.
+    `hits` and `misses` count the lookups, to help tune `max_html_size`.
+
+    """
+    def __init__(self, max_html_size=HTML_CACHE_SIZE):
+        self.max_html_size = max_html_size
+        self.html_size = 0
+        self.html = collections.OrderedDict()
+        self.other = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return "<ResourceCache hits={hits} misses={misses} html_size={html_size} />".format(
+            hits=self.hits,
+            misses=self.misses,
+            html_size=self.html_size,
+        )
+
+    def __contains__(self, identifier):
+        return identifier in self.html or identifier in self.other
+
+    def get(self, identifier):
+        """
+        Get the content of `identifier`, or None if it isn't cached.
+        """
+        if identifier in self.html:
+            self.html.move_to_end(identifier)
+            content = self.html[identifier]
+        else:
+            content = self.other.get(identifier)
+        if content is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return content
+
+    def put(self, identifier, content):
+        res_type, details = content
+        if res_type != "html":
+            self.other[identifier] = content
+            return
+        size = len(details["html"])
+        if size > self.max_html_size:
+            return
+        self.html[identifier] = content
+        self.html_size += size
+        while self.html_size > self.max_html_size:
+            _, (_, evicted) = self.html.popitem(last=False)
+            self.html_size -= len(evicted["html"])
+
+
+class ResourcePrefetcher:
+    """
+    Read the resources of a cartridge ahead of their use, in a thread pool.
+
+    `identifiers` are the resources in the order they will be asked for
+    with `get`.  At most `workers` are read at the same time, and only a
+    few ahead of the one being asked for, so memory stays bounded however
+    big the course is.  Results go through the cartridge's `resource_cache`
+    like with `Cartridge.get_resource_content`, and come out in the order
+    they are asked for, so the output doesn't change.
+
+    """
+    def __init__(self, cartridge, identifiers, workers):
+        self.cartridge = cartridge
+        self.workers = workers
+        self.window = 2 * workers
+        self.pending = collections.deque(dict.fromkeys(identifiers))
+        self.futures = {}
+        self.executor = None
+        # Build the index now, rather than racing to build it in the threads.
+        cartridge.resources_by_id
+
+    def __enter__(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        self._fill()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for future in self.futures.values():
+            future.cancel()
+        self.futures = {}
+        self.executor.shutdown(wait=True)
+
+    def get(self, identifier):
+        """
+        Get the resource named by `identifier`, like `Cartridge.get_resource_content`.
+        """
+        cache = self.cartridge.resource_cache
+        future = self.futures.pop(identifier, None)
+        self._fill()
+        content = cache.get(identifier)
+        if content is None:
+            if future is None:
+                content = self.cartridge.read_resource_content(identifier)
+            else:
+                content = future.result()
+            cache.put(identifier, content)
+        elif future is not None:
+            future.cancel()
+        return content
+
+    def _fill(self):
+        cache = self.cartridge.resource_cache
+        while self.pending and len(self.futures) < self.window:
+            identifier = self.pending.popleft()
+            if identifier in cache:
+                continue
+            self.futures[identifier] = self.executor.submit(
+                self.cartridge.read_resource_content, identifier,
+            )
+
+
 class Cartridge:
-    def __init__(self, cartridge_file):
+    def __init__(self, cartridge_file, config=None):
+        """
+        `cartridge_file` is the path of the .imscc file, or a binary file
+        object opened on it.
+        """
         self.cartridge = zipfile.ZipFile(cartridge_file)
-        self.metadata = None
-        self.resources = None
-        self.resources_by_id = {}
-        self.organizations = None
+        self.config = config or Config()
+        # The manifest is parsed the first time it is needed: see the
+        # properties below, and `load` to parse it all at once.
+        self._manifest = None
+        self._metadata = None
+        self._resources_by_id = None
+        self._resources_by_href = None
+        self._resources_by_type = None
+        self._course_settings_href = None
+        self._course_settings = None
         self.normalized = None
         self.version = '1.1'
-        self.file_path = cartridge_file
+        if isinstance(cartridge_file, str):
+            self.file_path = cartridge_file
+        else:
+            self.file_path = getattr(cartridge_file, 'name', None) or 'cartridge.imscc'
+        self.diagnostics = Diagnostics(os.path.basename(self.file_path))
         self.directory = None
+        self.extracted = False
         self.manifest_ns = {}
-        self.course_settings = {}
         self.course_settings_ns = {}
+        self.resource_cache = ResourceCache()
+        self.qti_parser = QtiParser(self)
+        # Replaced by an `instrumentation.Profile` to measure conversions.
+        self.profile = NULL_PROFILE
+        # A `cache.ConversionCache` to reuse resources across conversions.
+        self.conversion_cache = None
 
     def __repr__(self):
         filename = os.path.basename(self.file_path)
@@ -92,18 +305,97 @@ class Cartridge:
         )
         return text
 
-    def serialize(self):
-        output_directory = self.directory + '-olx'
-        course_directory = os.path.join(output_directory, 'course')
-        for directory in OLX_DIRECTORIES:
-            subdirectory = os.path.join(course_directory, directory)
-            filesystem.create_directory(subdirectory)
-        self.write_xml(self.get_course_xml(), course_directory, 'course.xml')
-        run_file = "course/{run}.xml".format(run=self.get_course_run())
-        self.write_xml(self.get_run_xml(), course_directory, run_file)
-        output_filename = self.directory + '.tar.gz'
-        with tarfile.open(output_filename, 'w:gz') as tar:
-            tar.add(course_directory, arcname=os.path.basename(course_directory))
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Close the cartridge archive.
+
+        The cartridge and its `qti_parser` refer to each other, so it is only
+        freed by the garbage collector: close it when done with it.
+
+        """
+        self.cartridge.close()
+
+    @property
+    def metadata(self):
+        """
+        The manifest metadata.
+
+        Only the start of the manifest is parsed for it, unless the whole
+        manifest was loaded already.
+
+        """
+        if self._metadata is None:
+            with self.cartridge.open(MANIFEST) as manifest:
+                self._set_metadata(self.parse_manifest_metadata(manifest))
+        return self._metadata
+
+    @property
+    def organizations(self):
+        return self._load_manifest_once()['organizations']
+
+    @property
+    def resources(self):
+        return self._load_manifest_once()['resources']
+
+    @property
+    def resources_by_id(self):
+        if self._resources_by_id is None:
+            self._index_resources()
+        return self._resources_by_id
+
+    @property
+    def resources_by_href(self):
+        """
+        The resources, by the href of the resource and of each of its files.
+
+        When several resources use a file, the first one has it.
+
+        """
+        if self._resources_by_href is None:
+            self._index_resources()
+        return self._resources_by_href
+
+    @property
+    def resources_by_type(self):
+        """
+        The lists of resources of each type, in manifest order.
+        """
+        if self._resources_by_type is None:
+            self._index_resources()
+        return self._resources_by_type
+
+    @property
+    def course_settings(self):
+        if self._course_settings is None:
+            self.load_course_settings()
+        return self._course_settings
+
+    def _index_resources(self):
+        by_id = {}
+        by_href = {}
+        by_type = collections.defaultdict(list)
+        course_settings_href = None
+        for resource in self.resources:
+            by_id[resource.identifier] = resource
+            by_type[resource.type].append(resource)
+            if resource.href is not None:
+                by_href.setdefault(resource.href, resource)
+            for res_file in resource.children:
+                if not isinstance(res_file, ResourceFile):
+                    continue
+                by_href.setdefault(res_file.href, resource)
+                if course_settings_href is None and COURSE_SETTINGS in res_file.href:
+                    course_settings_href = res_file.href
+        self._resources_by_id = by_id
+        self._resources_by_href = by_href
+        self._resources_by_type = dict(by_type)
+        self._course_settings_href = course_settings_href
 
     def normalize(self):
         organizations = self.organizations
@@ -125,13 +417,13 @@ class Cartridge:
             organization = organizations[0]
         if not organization:
             return
-        identifier = organization.get('identifier', 'org_1')
-        structure = organization.get('structure', 'rooted-hierarchy')
+        identifier = organization.identifier or 'org_1'
+        structure = organization.structure or 'rooted-hierarchy'
         # An organization may have a title element.
         title = None
         # An organization may have 0 or 1 item.
         # We'll treat it as the courseware root.
-        course_root = organization.get('children', [])
+        course_root = organization.children
         # Question: Does it have it have identifier="LearningModules"?
         count_root = len(course_root)
         if count_root == 0:
@@ -145,17 +437,13 @@ class Cartridge:
             course_root = course_root[0]
         if not course_root:
             return
-        sections = course_root.get('children', [])
+        sections = course_root.children
         # print(
         #     "course({count})".format(
         #         count=len(sections),
         #     )
         # )
-        normal_course = {
-            'children': [],
-            'identifier': identifier,
-            'structure': 'rooted-hierarchy',
-        }
+        normal_course = Organization(identifier, 'rooted-hierarchy')
         for section in sections:
             if is_leaf(section):
                 # Structure is too shallow.
@@ -168,36 +456,35 @@ class Cartridge:
                 # Found only leaves inside section.
                 if DIFFUSE_SHALLOW_SECTIONS:
                     subsections = [
-                        {
-                            'identifier': 'x'*34,
-                            'title': 'none',
-                            'children': [
+                        Item(
+                            identifier='x'*34,
+                            title='none',
+                            children=[
                                 subsection,
                             ],
-                        }
-                        for subsection in section.get('children', [])
+                        )
+                        for subsection in section.children
                     ]
                 else:
                     subsections = [
-                        {
-                            'identifier': 'x'*34,
-                            'title': 'none',
-                            'children': section.get('children', []),
-                        },
+                        Item(
+                            identifier='x'*34,
+                            title='none',
+                            children=section.children,
+                        ),
                     ]
             else:
-                subsections = section.get('children', [])
+                subsections = section.children
             pprint(0, 'section', section, len(subsections))
-            normal_section = {
-                'children': [],
-                'identifier': section.get('identifier'),
-                'identifierref': section.get('identifierref'),
-                'title': section.get('title'),
-            }
+            normal_section = Item(
+                identifier=section.identifier,
+                identifierref=section.identifierref,
+                title=section.title,
+            )
             if len(subsections) == 1:
                 subsect = subsections[0]
-                if subsect.get("title", "none") == "none":
-                    subsect["title"] = section.get("title", "none")
+                if (subsect.title or "none") == "none":
+                    subsect.title = section.title or "none"
             for subsection in subsections:
                 if is_leaf(subsection):
                     # Structure is too shallow.
@@ -210,32 +497,31 @@ class Cartridge:
                     # Found only leaves inside subsection.
                     if DIFFUSE_SHALLOW_SUBSECTIONS:
                         units = [
-                            {
-                                'identifier': 'x'*34,
-                                'title': unit.get('title', 'none'),
-                                'children': [
+                            Item(
+                                identifier='x'*34,
+                                title=unit.title or 'none',
+                                children=[
                                     unit,
                                 ],
-                            }
-                            for unit in subsection.get('children', [])
+                            )
+                            for unit in subsection.children
                         ]
                     else:
                         units = [
-                            {
-                                'identifier': 'x'*34,
-                                'title': 'none',
-                                'children': subsection.get('children', []),
-                            },
+                            Item(
+                                identifier='x'*34,
+                                title='none',
+                                children=subsection.children,
+                            ),
                         ]
                 else:
-                    units = subsection.get('children', [])
+                    units = subsection.children
                 pprint(1, 'subsection', subsection, len(units))
-                normal_subsection = {
-                    'children': [],
-                    'identifier': subsection.get('identifier'),
-                    'identifierref': subsection.get('identifierref'),
-                    'title': subsection.get('title'),
-                }
+                normal_subsection = Item(
+                    identifier=subsection.identifier,
+                    identifierref=subsection.identifierref,
+                    title=subsection.title,
+                )
                 for unit in units:
                     if is_leaf(unit):
                         # Structure is too shallow.
@@ -244,69 +530,47 @@ class Cartridge:
                             unit,
                         ]
                     else:
-                        components = unit.get('children', [])
-                        components = self.flatten(components)
+                        components = self.flatten(unit.children)
                     pprint(2, 'unit', unit, len(components))
-                    normal_unit = {
-                        'children': [],
-                        'identifier': unit.get('identifier'),
-                        'identifierref': unit.get('identifierref'),
-                        'title': unit.get('title'),
-                    }
+                    normal_unit = Item(
+                        identifier=unit.identifier,
+                        identifierref=unit.identifierref,
+                        title=unit.title,
+                    )
                     for component in components:
                         pprint(3, 'component', component)
-                        normal_unit['children'].append(component)
-                    normal_subsection['children'].append(normal_unit)
-                normal_section['children'].append(normal_subsection)
-            normal_course['children'].append(normal_section)
+                        normal_unit.children.append(component)
+                    normal_subsection.children.append(normal_unit)
+                normal_section.children.append(normal_subsection)
+            normal_course.children.append(normal_section)
         self.normalized = normal_course
         return normal_course
 
     def flatten(self, container):
+        if isinstance(container, list):
+            return list(self.iter_leaves(container))
         if is_leaf(container):
             return container
-        if isinstance(container, list):
-            children = container
-        else:
-            # Structure is too deep.
-            # Flatten into current unit?
-            # Found non-leaf at component level
-            children = container.get('children', [])
-        output = []
-        for child in children:
-            if is_leaf(child):
-                output.append(child)
-            else:
-                leaves = self.flatten(child)
-                output.extend(leaves)
-        return output
-
-    def write_xml(self, text, output_base, output_file):
-        text += '\n'
-        output_path = os.path.join(output_base, output_file)
-        with open(output_path, 'w') as output:
-            output.write(text)
-
-    def get_course_xml(self):
-        text = '<course org="{org}" course="{number}" url_name="{run}" />'.format(
-            org=self.get_course_org(),
-            number=self.get_course_number(),
-            run=self.get_course_run(),
-        )
-        return text
+        # Structure is too deep.
+        # Flatten into current unit?
+        # Found non-leaf at component level
+        return list(self.iter_leaves(container.children))
 
-    def get_run_xml(self):
-        text = dedent("""\
-            <course
-                display_name="{title}"
-                language="{language}"
-            >
-            </course>\
-        """).format(
-            title=self.get_title(),
-            language=self.get_language(),
-        ).strip()
-        return text
+    def iter_leaves(self, items):
+        """
+        Yield the leaves under the list of `items`, in document order.
+
+        Uses an explicit stack rather than recursion, so that very deep
+        organizations take linear time and no Python recursion.
+
+        """
+        stack = list(reversed(items))
+        while stack:
+            item = stack.pop()
+            if is_leaf(item):
+                yield item
+            else:
+                stack.extend(reversed(item.children))
 
     def get_title(self):
         # TODO: Choose a better default course title
@@ -330,14 +594,26 @@ class Cartridge:
         # TODO: find a better value for this; lifecycle.contribute_date?
         return 'run'
 
+    def get_workspace_directory(self):
+        return os.path.join(
+            self.config.workspace,
+            filesystem.strip_extension(self.file_path),
+        )
+
     def _extract_manifest(self):
-        settings = collect_settings()
-        workspace = settings['workspace']
-        path_extracted = filesystem.unzip_directory(self.file_path, workspace)
+        path_extracted = self.get_workspace_directory()
+        self.cartridge.extractall(path_extracted)
         self.directory = path_extracted
+        self.extracted = True
         manifest = os.path.join(path_extracted, MANIFEST)
         return manifest
 
+    def _open_manifest(self):
+        # Nothing is extracted yet, but files that have to land on disk
+        # will go to the same place a full extraction would put them.
+        self.directory = self.get_workspace_directory()
+        return self.cartridge.open(MANIFEST)
+
     def _update_namespaces(self, root):
         ns = re.match('\{(.*)\}', root.tag).group(1)
         version = re.match('.*/(imsccv\dp\d)/', ns).group(1)
@@ -351,18 +627,19 @@ class Cartridge:
         self.course_settings_ns['wl'] = ns
 
     def _extract_course_settings(self):
-        for resource in self.resources:
-            for res_file in resource.get('children'):
-                if COURSE_SETTINGS in res_file.href:
-                    return filesystem.get_xml_tree(self.res_filename(res_file.href))
+        if self._resources_by_href is None:
+            self._index_resources()
+        if self._course_settings_href is not None:
+            return self.get_xml_tree(self._course_settings_href)
 
-    def load_course_settings_extracted(self):
+    def load_course_settings(self):
+        self._course_settings = {}
         tree = self._extract_course_settings()
         if tree:
             root = tree.getroot()
             self._update_course_settings_namespace(root)
             data = self.parse_course_settings(root)
-            self.course_settings = data
+            self._course_settings = data
 
     def parse_course_settings(self, node):
         data = {}
@@ -374,29 +651,151 @@ class Cartridge:
             data['end_date'] = conclude_at.text
         return data
 
+    def load(self):
+        """
+        Load the manifest and course settings, as `self.config` says.
+
+        Everything loaded here is otherwise loaded on first use; a conversion
+        needs it all, and loading it upfront keeps the profile phases apart.
+
+        """
+        with self.profile.phase('manifest'):
+            data = self._load_manifest_once()
+        with self.profile.phase('course_settings'):
+            if self._course_settings is None:
+                self.load_course_settings()
+        return data
+
+    def _load_manifest_once(self):
+        if self._manifest is None:
+            if self.config.extract:
+                self.load_manifest_extracted()
+            else:
+                self.load_manifest()
+        return self._manifest
+
     def load_manifest_extracted(self):
         manifest = self._extract_manifest()
-        tree = filesystem.get_xml_tree(manifest)
-        root = tree.getroot()
-        self._update_namespaces(root)
-        data = self.parse_manifest(root)
-        self.metadata = data['metadata']
-        self.organizations = data['organizations']
-        self.resources = data['resources']
-        self.resources_by_id = { r["identifier"]: r for r in self.resources }
-        self.version = self.metadata.get('schema', {}).get('version', self.version)
+        data = self.parse_manifest_stream(manifest)
+        return self._load_manifest_data(data)
+
+    def load_manifest(self):
+        """
+        Load the manifest straight from the cartridge archive.
+
+        Unlike `load_manifest_extracted`, nothing is written to the workspace:
+        resource files are read lazily from the zip with `res_open`.
+
+        """
+        with self._open_manifest() as manifest:
+            data = self.parse_manifest_stream(manifest)
+        return self._load_manifest_data(data)
+
+    def _load_manifest_data(self, data):
+        self._manifest = data
+        self._set_metadata(data['metadata'])
+        self._resources_by_id = None
+        self._resources_by_href = None
+        self._resources_by_type = None
         return data
 
-    def parse_manifest(self, node):
-        data = dict()
-        data['metadata'] = self.parse_metadata(node)
-        data['organizations'] = self.parse_organizations(node)
-        data['resources'] = self.parse_resources(node)
+    def _set_metadata(self, metadata):
+        self._metadata = metadata
+        self.version = metadata.get('schema', {}).get('version', self.version)
+
+    def parse_manifest_stream(self, source):
+        """
+        Parse the manifest in `source`, a path or binary file, in one pass.
+
+        Organizations are built from the parser's events, and elements are
+        dropped as soon as they are parsed, so big manifests never sit in
+        memory as a whole.
+
+        """
+        data = {
+            'metadata': {},
+            'organizations': [],
+            'resources': [],
+        }
+        ancestors = []
+        # The organization and the items being built, innermost last.
+        items = []
+        for event, element in ElementTree.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                if not ancestors:
+                    self._update_namespaces(element)
+                    ns = '{' + self.manifest_ns['ims'] + '}'
+                    tag_organizations = ns + 'organizations'
+                    tag_organization = ns + 'organization'
+                    tag_item = ns + 'item'
+                    tag_title = ns + 'title'
+                    tag_resources = ns + 'resources'
+                    tag_metadata = ns + 'metadata'
+                parent = ancestors[-1] if ancestors else None
+                if element.tag == tag_organization and parent.tag == tag_organizations:
+                    items.append(Organization(
+                        identifier=element.get('identifier'),
+                        structure=element.get('structure'),
+                    ))
+                elif element.tag == tag_item and items:
+                    items.append(Item(
+                        identifier=element.get('identifier') or None,
+                        identifierref=element.get('identifierref') or None,
+                    ))
+                ancestors.append(element)
+                continue
+            ancestors.pop()
+            if not ancestors:
+                break
+            parent = ancestors[-1]
+            tag = element.tag
+            if tag == tag_title and parent.tag == tag_item and len(items) > 1:
+                if element.text and items[-1].title is None:
+                    items[-1].title = element.text
+            elif tag == tag_item and len(items) > 1:
+                item = items.pop()
+                if not item.is_empty():
+                    items[-1].children.append(item)
+                del parent[-1]
+            elif tag == tag_organization and parent.tag == tag_organizations:
+                data['organizations'].append(items.pop())
+                del parent[-1]
+            elif parent.tag == tag_resources:
+                data['resources'].append(self.parse_resource(element))
+                del parent[-1]
+            elif tag == tag_metadata and len(ancestors) == 1:
+                data['metadata'] = self.parse_metadata_element(element)
+                del parent[-1]
         return data
 
-    def parse_metadata(self, node):
+    def parse_manifest_metadata(self, source):
+        """
+        Parse only the metadata of the manifest in `source`.
+
+        The metadata comes first in manifests: parsing stops at its end,
+        before the organizations and resources.
+
+        """
+        depth = 0
+        metadata = {}
+        for event, element in ElementTree.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                if depth == 0:
+                    self._update_namespaces(element)
+                    root = element
+                    tag_metadata = '{' + self.manifest_ns['ims'] + '}metadata'
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1:
+                if element.tag == tag_metadata:
+                    metadata = self.parse_metadata_element(element)
+                    break
+                root.clear()
+        return metadata
+
+    def parse_metadata_element(self, metadata):
         data = dict()
-        metadata = node.find('./ims:metadata', self.manifest_ns)
         if metadata:
             data['schema'] = self.parse_schema(metadata)
             data['lom'] = self.parse_lom(metadata)
@@ -481,72 +880,14 @@ class Cartridge:
         data['contribute_date'] = text
         return data
 
-    def parse_organizations(self, node):
-        data = []
-        element = node.find('ims:organizations', self.manifest_ns) or []
-        data = [
-            self.parse_organization(org_node)
-            for org_node in element
-        ]
-        return data
-
-    def parse_organization(self, node):
-        data = {}
-        data['identifier'] = node.get('identifier')
-        data['structure'] = node.get('structure')
-        children = []
-        for item_node in node:
-            child = self.parse_item(item_node)
-            if len(child):
-                children.append(child)
-        if len(children):
-            data['children'] = children
-        return data
-
-    def parse_item(self, node):
-        data = {}
-        identifier = node.get('identifier')
-        if identifier:
-            data['identifier'] = identifier
-        identifierref = node.get('identifierref')
-        if identifierref:
-            data['identifierref'] = identifierref
-        title = self.parse_text(node, 'ims:title')
-        if title:
-            data['title'] = title
-        children = []
-        for child in node:
-            child_item = self.parse_item(child)
-            if len(child_item):
-                children.append(child_item)
-        if children and len(children):
-            data['children'] = children
-        return data
-
-    def parse_resources(self, node):
-        data = []
-        element = node.find('ims:resources', self.manifest_ns) or []
-        data = [
-            self.parse_resource(sub_element)
-            for sub_element in element
-        ]
-        return data
-
     def parse_resource(self, node):
-        data = {}
-        identifier = node.get('identifier')
-        if identifier:
-            data['identifier'] = identifier
-        _type = node.get('type')
-        if _type:
-            data['type'] = _type
-        href = node.get('href')
-        if href:
-            data['href'] = href
-        intended_use = node.get('intended_use')
-        if intended_use:
-            data['intended_use'] = intended_use
-        children = []
+        data = Resource(
+            identifier=node.get('identifier') or None,
+            type=node.get('type') or None,
+            href=node.get('href') or None,
+            intended_use=node.get('intended_use') or None,
+        )
+        children = data.children
         for child in node:
             prefix, has_namespace, postfix = child.tag.partition('}')
             tag = postfix
@@ -557,12 +898,10 @@ class Cartridge:
             elif tag == 'metadata':
                 child_data = self.parse_resource_metadata(child)
             else:
-                print('UNSUPPORTED RESOURCE TYPE', tag)
+                self.diagnostics.event('unsupported_resource_element', tag=tag)
                 continue
             if child_data:
                 children.append(child_data)
-        if children and len(children):
-            data['children'] = children
         return data
 
     def parse_file(self, node):
@@ -582,8 +921,71 @@ class Cartridge:
     def res_filename(self, file_name):
         return os.path.join(self.directory, file_name)
 
+    def res_open(self, file_name):
+        """
+        Open the resource file `file_name` for reading, in binary mode.
+
+        Extracted cartridges are read from the workspace, others straight
+        from the zip archive.
+
+        """
+        if self.extracted:
+            return open(self.res_filename(file_name), 'rb')
+        return self.cartridge.open(file_name)
+
+    def res_size(self, file_name):
+        """
+        Get the size in bytes of the resource file `file_name`.
+        """
+        if self.extracted:
+            return os.path.getsize(self.res_filename(file_name))
+        return self.res_info(file_name).file_size
+
+    def read_html(self, file_name):
+        """
+        Read the HTML resource file `file_name`, as UTF-8 bytes.
+        """
+        with self.res_open(file_name) as res_file:
+            return charsets.to_utf8(res_file.read())
+
+    def iter_html(self, file_name, chunk_size):
+        """
+        Read the HTML resource file `file_name` as chunks of UTF-8 bytes.
+        """
+        with self.res_open(file_name) as res_file:
+            yield from charsets.iter_utf8(iter(lambda: res_file.read(chunk_size), b""))
+
+    def res_info(self, file_name):
+        """
+        Get the `zipfile.ZipInfo` of the resource file `file_name`.
+        """
+        return self.cartridge.getinfo(file_name)
+
+    def get_static_files(self):
+        """
+        Get the hrefs of the web content files that aren't pages.
+
+        They are listed in the order they are stored in the archive, so that
+        they can be read in a single sweep.
+
+        """
+        hrefs = set()
+        for resource in self.resources_by_type.get('webcontent', []):
+            for res_file in resource.children:
+                if isinstance(res_file, ResourceFile) and not res_file.href.endswith('.html'):
+                    hrefs.add(res_file.href)
+        offsets = {info.filename: info.header_offset for info in self.cartridge.infolist()}
+        missing = sorted(hrefs - offsets.keys())
+        for href in missing:
+            self.diagnostics.event('missing_static_file', href=href)
+        return sorted(hrefs & offsets.keys(), key=offsets.get)
+
+    def get_xml_tree(self, file_name):
+        with self.res_open(file_name) as res_file:
+            return filesystem.get_xml_tree(res_file)
+
     def parse_lti(self, resource):
-        tree = filesystem.get_xml_tree(self.res_filename(resource["children"][0].href))
+        tree = self.get_xml_tree(resource.children[0].href)
         root = tree.getroot()
         ns = {
             'blti': 'http://www.imsglobal.org/xsd/imsbasiclti_v1p0',
@@ -631,9 +1033,52 @@ class Cartridge:
         """
         Get the resource named by `identifier`.
 
+        Each resource is read and parsed once: see `load_resource_content`
+        for the result.
+
+        """
+        content = self.resource_cache.get(identifier)
+        if content is None:
+            content = self.read_resource_content(identifier)
+            self.resource_cache.put(identifier, content)
+        return content
+
+    def read_resource_content(self, identifier):
+        """
+        Read the resource named by `identifier`, without `resource_cache`.
+
+        Several resources can be read at the same time from different
+        threads: see `ResourcePrefetcher`.
+
+        """
+        res = self.resources_by_id.get(identifier)
+        res_type = res.type if res is not None else 'missing'
+        with self.profile.resource(res_type):
+            return self._load_cached_resource_content(identifier, res)
+
+    def _load_cached_resource_content(self, identifier, res):
+        if self.conversion_cache is None:
+            return self.load_resource_content(identifier)
+        key = self.conversion_cache.resource_key(self, res)
+        content = key and self.conversion_cache.get_resource(key)
+        if content is None:
+            content = self.load_resource_content(identifier)
+            if key:
+                self.conversion_cache.put_resource(key, content)
+        return content
+
+    def load_resource_content(self, identifier):
+        """
+        Read the resource named by `identifier`.
+
         If the resource can be retrieved, returns a tuple: the first element
-        indicates the type of content, either "html" or "link".  The second
-        element is a dict with details, which vary by the type.
+        indicates the type of content, either "html", "html_file" (a page
+        too big to read in memory, see `Config.stream_html_size`, to read
+        with `iter_html`), "link", "lti", "qti" (an assessment, see
+        `qti.QtiParser.parse_assessment`) or "static" (a file from
+        `get_static_files`).  The second element is a dict with details,
+        which vary by the type: the "html" of pages is UTF-8 bytes, whatever
+        the encoding of their file.
 
         If the resource can't be retrieved, returns a tuple of None, None.
 
@@ -641,25 +1086,28 @@ class Cartridge:
 
         res = self.resources_by_id.get(identifier)
         if res is None:
-            print("*** Missing resource: {}".format(identifier))
+            self.diagnostics.event('missing_resource', identifier=identifier)
             return None, None
 
-        res_type = res["type"]
+        res_type = res.type
         if res_type == "webcontent":
-            res_filename = self.res_filename(res["children"][0].href)
+            res_href = res.children[0].href
+            res_filename = self.res_filename(res_href)
             if res_filename.endswith(".html"):
+                stream_size = self.config.stream_html_size
+                if stream_size and self.res_size(res_href) > stream_size:
+                    return "html_file", { "href": res_href }
                 try:
-                    with open(res_filename) as res_file:
-                        html = res_file.read()
+                    html = self.read_html(res_href)
                 except:
-                    print("Failure reading {!r} from id {}".format(res_filename, identifier))
+                    self.diagnostics.event('unreadable_resource', href=res_href, identifier=identifier)
                     raise
                 return "html", { "html": html }
             else:
-                print("*** Skipping webcontent: {}".format(res_filename))
-                return None, None
+                # Not a page: the file itself is copied to static/.
+                return "static", { "href": res_href }
         elif res_type == "imswl_xmlv1p1":
-            tree = filesystem.get_xml_tree(self.res_filename(res["children"][0].href))
+            tree = self.get_xml_tree(res.children[0].href)
             root = tree.getroot()
             ns = {"wl": "http://www.imsglobal.org/xsd/imsccv1p1/imswl_v1p1"}
             title = root.find("wl:title", ns).text
@@ -668,9 +1116,12 @@ class Cartridge:
         elif res_type == 'imsbasiclti_xmlv1p0':
             data = self.parse_lti(res)
             return 'lti', data
+        elif res_type in ASSESSMENT_TYPES:
+            data = self.qti_parser.parse_assessment(res)
+            return 'qti', data
         else:
             text = "Unimported content: type = {!r}".format(res_type)
-            if "href" in res:
-                text += ", href = {!r}".format(res["href"])
-            print("***", text)
-            return "html", { "html": text }
+            if res.href is not None:
+                text += ", href = {!r}".format(res.href)
+            self.diagnostics.event('unimported_content', type=res_type, href=res.href)
+            return "html", { "html": text.encode("utf8") }
@@ -1,72 +1,579 @@
-import io
+import collections
+import concurrent.futures
+import contextlib
+import dataclasses
+import hashlib
+import itertools
+import os.path
+import posixpath
 import re
+import shutil
 import tarfile
-import xml.dom.minidom
+import tempfile
+import urllib.parse
+import uuid
+
+from xml.etree import ElementTree
+
+from cc2olx import filesystem
+from cc2olx import qti
+from cc2olx.diagnostics import Diagnostics
+from cc2olx.models import Cartridge, ResourcePrefetcher
+from cc2olx.settings import RESULT_TYPE_FOLDER, RESULT_TYPE_ZIP
+
+
+COPY_CHUNK_SIZE = 64 * 1024
+
+WEB_RESOURCES = "web_resources"
+WIKI_CONTENT = "wiki_content"
+# The references to rewrite in HTML, with an optional query string to drop:
+# course files, course pages, and relative URLs in href and src attributes.
+# Every match starts with one of "$%hs", and the pattern says so upfront:
+# the regex engine then skips quickly to those characters, instead of
+# trying each branch at every position.
+REFERENCE_RE = re.compile(
+    rb"[$%hs](?:"
+    rb"(?:(?<=\$)IMS-CC-FILEBASE\$|(?<=%)24IMS-CC-FILEBASE%24)/(?P<file>[^\"'?#<>\s]+)(?:\?[^\"'#<>\s]*)?"
+    rb"|(?:(?<=\$)WIKI_REFERENCE\$|(?<=%)24WIKI_REFERENCE%24)/pages/(?P<page>[^\"'?#<>\s]+)(?:\?[^\"'#<>\s]*)?"
+    rb"|(?<!\w[hs])(?:(?<=h)ref|(?<=s)rc)\s*=\s*[\"'](?P<relative>(?![a-zA-Z][\w+.-]*:|[/#$%?])[^\"'<>\s]+)"
+    rb")"
+)
+# Characters that the file and page references never contain, and the
+# markers they start with.
+REFERENCE_SEPARATORS = b"\"'<> \t\n\r\f\v"
+REFERENCE_MARKERS = [
+    b"$IMS-CC-FILEBASE$",
+    b"%24IMS-CC-FILEBASE%24",
+    b"$WIKI_REFERENCE$",
+    b"%24WIKI_REFERENCE%24",
+]
+# The start of a relative URL attribute, cut short by the end of the text.
+PARTIAL_ATTRIBUTE_RE = re.compile(
+    rb"(?:\b(?:h|hr|hre|s|sr)|\b(?:href|src)\s*(?:=\s*(?:[\"'](?![a-zA-Z][\w+.-]*:|[/#$%?])[^\"'<>\s]*)?)?)\Z"
+)
+# How far before a relative URL its attribute name may start.
+ATTRIBUTE_LOOKBEHIND = 256
+
+
+class XmlWriter:
+    """
+    Write XML to a text stream as it is produced.
+
+    Elements are written as soon as they are started, so memory use depends
+    on the depth of the tree, not on its size.  The output is laid out like
+    `xml.dom.minidom`'s `toprettyxml`.
+
+    """
+    def __init__(self, stream, indent="\t", newl="\n"):
+        self.stream = stream
+        self.indent = indent
+        self.newl = newl
+        self.tags = []
+        # True while the start tag of the innermost element is still open,
+        # that is, until we know whether the element has children.
+        self.pending = False
+
+    def start(self, tag, attrs=None):
+        self._close_pending()
+        self._write_start(tag, attrs)
+        self.tags.append(tag)
+        self.pending = True
+
+    def end(self):
+        tag = self.tags.pop()
+        if self.pending:
+            self.stream.write("/>" + self.newl)
+            self.pending = False
+        else:
+            self.stream.write("{}</{}>{}".format(self._indentation(), tag, self.newl))
+
+    def element(self, tag, attrs=None):
+        """
+        Write a complete element, without children.
+        """
+        self._close_pending()
+        self._write_start(tag, attrs)
+        self.stream.write("/>" + self.newl)
+
+    def tree(self, element):
+        """
+        Write the `ElementTree.Element` `element` and its descendants.
+
+        Elements with text content are written on one line, as they are, so
+        that the indentation doesn't change their text.
+
+        """
+        if (element.text or "").strip() or any((child.tail or "").strip() for child in element):
+            self._close_pending()
+            tail, element.tail = element.tail, None
+            text = ElementTree.tostring(element, encoding="unicode")
+            element.tail = tail
+            self.stream.write(self._indentation() + text + self.newl)
+        elif len(element):
+            self.start(element.tag, element.attrib)
+            for child in element:
+                self.tree(child)
+            self.end()
+        else:
+            self.element(element.tag, element.attrib)
+
+    def _write_start(self, tag, attrs):
+        self.stream.write("{}<{}".format(self._indentation(), tag))
+        for name, value in (attrs or {}).items():
+            self.stream.write(' {}="{}"'.format(name, escape_attribute(value)))
+
+    def _close_pending(self):
+        if self.pending:
+            self.stream.write(">" + self.newl)
+            self.pending = False
+
+    def _indentation(self):
+        return self.indent * len(self.tags)
+
+
+def escape_attribute(value):
+    value = str(value)
+    value = value.replace("&", "&amp;").replace("<", "&lt;")
+    value = value.replace('"', "&quot;").replace(">", "&gt;")
+    return value
+
+
+class UrlNames:
+    """
+    Allocate url_names for OLX blocks, based on their identifiers.
+
+    A url_name is unique among the blocks with the same tag, since that is
+    what names their files.
+
+    """
+    def __init__(self):
+        self.used = set()
+        # How many times each (tag, base) was asked for, so that repeated
+        # identifiers don't rescan all the numbers already given out.
+        self.counts = {}
+
+    def allocate(self, tag, identifier):
+        base = url_name_base(tag, identifier)
+        count = self.counts.get((tag, base), 0)
+        url_name = base
+        if count:
+            url_name = "{}_{}".format(base, count + 1)
+        while (tag, url_name) in self.used:
+            count += 1
+            url_name = "{}_{}".format(base, count + 1)
+        self.counts[(tag, base)] = count + 1
+        self.used.add((tag, url_name))
+        return url_name
+
+
+def url_name_base(tag, identifier):
+    """
+    Get the url_name that `UrlNames` gives first to `identifier`.
+    """
+    return re.sub(r"[^\w.-]", "_", identifier or "") or tag
+
+
+class CourseDirectory:
+    """
+    A directory that the files of a multi-file OLX course are written to.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def open(self, path, mode="w"):
+        """
+        Open the file at `path`, relative to the course root, for writing.
+
+        Files are opened for writing text unless `mode` is "wb".
+
+        """
+        full_path = os.path.join(self.root, path)
+        filesystem.create_directory(os.path.dirname(full_path))
+        if "b" in mode:
+            return open(full_path, mode)
+        return open(full_path, mode, encoding="utf8")
+
 
 class OlxExport:
     def __init__(self, cartridge):
         self.cartridge = cartridge
-        self.doc = None
-
-    def xml(self):
-        self.doc = xml.dom.minidom.Document()
-        self.doc.appendChild(self.doc.createComment(" Generated by cc2olx "))
-        xcourse = self.doc.createElement("course")
-        self.doc.appendChild(xcourse)
-        xcourse.setAttribute("org", self.cartridge.get_course_org())
-        xcourse.setAttribute("course", "Some_cc_Course")
-        xcourse.setAttribute("name", self.cartridge.get_title())
+        # Maps the href of each file copied to static/ to its name there.
+        self.static_names = {}
+        # Reads resources ahead of the leaves being written, when prefetching.
+        self.prefetcher = None
+        self.link_rewriter = None
+
+    def write_course(self, output):
+        """
+        Write the course as a directory of OLX files, one per block.
+
+        `output` is a `CourseDirectory`.  Every chapter, sequential, vertical
+        and component gets its own file, and parents refer to their children
+        by `url_name`.  Chapters don't share any files, so they can be written
+        independently.
+
+        With `Config.chapter_jobs`, the components of the chapters are
+        rendered in parallel, see `_rendering_in_processes`.
+
+        """
+        url_names = UrlNames()
+        run = self.cartridge.get_course_run()
+        with self.cartridge.profile.phase('static'):
+            self.static_names = self._write_static(output)
+        with output.open("course.xml") as stream:
+            writer = XmlWriter(stream)
+            writer.element("course", {
+                "org": self.cartridge.get_course_org(),
+                "course": self.cartridge.get_course_number(),
+                "url_name": run,
+            })
+        tags = "chapter sequential vertical".split()
+        self.link_rewriter = self._create_link_rewriter(tags)
+        with self._rendering(output, tags) as leaves:
+            chapters = [
+                reference
+                for dd in self.cartridge.normalized.children
+                for reference in self._write_block(output, url_names, dd, tags, leaves)
+            ]
+        attrs = {
+            "display_name": self.cartridge.get_title(),
+            "language": self.cartridge.get_language(),
+        }
         if self.cartridge.course_settings.get('start_date'):
-            xcourse.setAttribute("start", self.cartridge.course_settings['start_date'])
+            attrs["start"] = self.cartridge.course_settings['start_date']
         if self.cartridge.course_settings.get('end_date'):
-            xcourse.setAttribute("end", self.cartridge.course_settings['end_date'])
+            attrs["end"] = self.cartridge.course_settings['end_date']
+        with output.open("course/{}.xml".format(run)) as stream:
+            writer = XmlWriter(stream)
+            writer.start("course", attrs)
+            for tag, url_name in chapters:
+                writer.element(tag, {"url_name": url_name})
+            writer.end()
 
-        tags = "chapter sequential vertical".split()
-        self._add_olx_nodes(xcourse, self.cartridge.normalized['children'], tags)
-        return self.doc.toprettyxml()
+    @contextlib.contextmanager
+    def _rendering(self, output, tags):
+        """
+        Render the components of the leaves, for `_write_block`.
+
+        Yields an iterator over the components of each leaf (see
+        `_leaf_elements`), in the order `_write_block` writes them.
+
+        """
+        jobs = self.cartridge.config.chapter_jobs
+        chapters = self.cartridge.normalized.children
+        if jobs > 1 and len(chapters) > 1 and os.path.isfile(self.cartridge.file_path):
+            with self._rendering_in_processes(output, tags, jobs) as leaves:
+                yield leaves
+            return
+        with self._prefetching(tags):
+            yield (
+                self._leaf_elements(dd)
+                for dd in self._iter_leaf_blocks(chapters, tags)
+            )
+
+    @contextlib.contextmanager
+    def _rendering_in_processes(self, output, tags, jobs):
+        """
+        Render the components of each chapter in a pool of `jobs` processes.
+
+        Each process renders whole chapters with a `ChapterRenderer`:
+        resource reading, link rewriting, and streamed pages, which go to
+        temporary files.  Chapters are gathered in order, a few ahead of the
+        one being written, and url_names are still allocated by the parent,
+        so the course is the same as when exported in turn.
+
+        """
+        chapters = len(self.cartridge.normalized.children)
+        with tempfile.TemporaryDirectory(dir=output.root) as spool_directory:
+            initargs = (
+                self.cartridge.file_path,
+                dataclasses.replace(self.cartridge.config, extract=False),
+                self.cartridge.conversion_cache,
+                self.static_names,
+                tags,
+                spool_directory,
+            )
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=jobs,
+                initializer=_init_chapter_renderer,
+                initargs=initargs,
+            ) as executor:
+                leaves = self._gather_chapters(executor, chapters, 2 * jobs)
+                try:
+                    yield leaves
+                finally:
+                    leaves.close()
+
+    def _gather_chapters(self, executor, chapters, window):
+        indexes = iter(range(chapters))
+        futures = collections.deque(
+            executor.submit(_render_chapter, index)
+            for index in itertools.islice(indexes, window)
+        )
+        try:
+            while futures:
+                leaves, events = futures.popleft().result()
+                for index in itertools.islice(indexes, 1):
+                    futures.append(executor.submit(_render_chapter, index))
+                self.cartridge.diagnostics.merge(events)
+                yield from leaves
+        finally:
+            for future in futures:
+                future.cancel()
+
+    @contextlib.contextmanager
+    def _prefetching(self, tags):
+        """
+        Read the resources of the leaves in threads while they are written.
+
+        The blocks at the depth of `tags` are the leaves, in the order they
+        are written.
+
+        """
+        workers = self.cartridge.config.prefetch
+        if workers < 1:
+            yield
+            return
+        identifiers = [
+            dd.identifierref
+            for dd in self._iter_leaf_blocks(self.cartridge.normalized.children, tags)
+            if dd.identifierref is not None
+        ]
+        with ResourcePrefetcher(self.cartridge, identifiers, workers) as prefetcher:
+            self.prefetcher = prefetcher
+            try:
+                yield
+            finally:
+                self.prefetcher = None
+
+    def _create_link_rewriter(self, tags):
+        """
+        Create the `LinkRewriter` for the HTML of the course.
+
+        Links to a page go to the first leaf that shows it, whose url_name is
+        its identifier, since leaves are written before the other blocks
+        with the same identifier.
+
+        """
+        page_url_names = {}
+        for dd in self._iter_leaf_blocks(self.cartridge.normalized.children, tags):
+            if dd.identifierref is not None and dd.identifier is not None:
+                page_url_names.setdefault(dd.identifierref, url_name_base("html", dd.identifier))
+        return LinkRewriter(self.static_names, self.cartridge.resources_by_href, page_url_names)
+
+    def _iter_leaf_blocks(self, data, tags):
+        stack = [(dd, 0) for dd in reversed(data)]
+        while stack:
+            dd, depth = stack.pop()
+            if depth == len(tags):
+                yield dd
+            else:
+                stack.extend((child, depth + 1) for child in reversed(dd.children))
+
+    def _get_resource_content(self, identifier):
+        if self.prefetcher is not None:
+            return self.prefetcher.get(identifier)
+        return self.cartridge.get_resource_content(identifier)
+
+    def _write_static(self, output):
+        """
+        Copy the cartridge's static files into static/, all in one go.
+
+        Files with identical contents are stored once.  Candidates are found
+        with the CRC32 and size the zip already records for every file, and
+        only confirmed by hashing when those collide.
+
+        Returns a dict mapping the href of each file to its static name.
+
+        """
+        static_names = {}
+        by_crc = {}
+        digests = {}
+        used_names = set()
+        for href in self.cartridge.get_static_files():
+            info = self.cartridge.res_info(href)
+            candidates = by_crc.setdefault((info.CRC, info.file_size), [])
+            name = None
+            for other_href, other_name in candidates:
+                if self._digest(other_href, digests) == self._digest(href, digests):
+                    name = other_name
+                    break
+            if name is None:
+                name = os.path.basename(href)
+                if name in used_names:
+                    name = "{}_{}".format(self._digest(href, digests)[:8], name)
+                used_names.add(name)
+                with self.cartridge.res_open(href) as source:
+                    with output.open("static/" + name, "wb") as destination:
+                        shutil.copyfileobj(source, destination)
+                candidates.append((href, name))
+            static_names[href] = name
+        return static_names
+
+    def _digest(self, href, digests):
+        if href not in digests:
+            digest = hashlib.sha1()
+            with self.cartridge.res_open(href) as res_file:
+                for chunk in iter(lambda: res_file.read(COPY_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            digests[href] = digest.hexdigest()
+        return digests[href]
+
+    def _write_block(self, output, url_names, dd, tags, leaves):
+        """
+        Write the block `dd` and its descendants, each to their own file.
+
+        `leaves` iterates over the components of the leaves, from `_rendering`.
+
+        Returns the list of tags and url_names the parent block should refer
+        to: a leaf can give several components.
+
+        """
+        if not tags:
+            return [
+                self._write_component(output, url_names, dd, *element)
+                for element in next(leaves)
+            ]
+        children = [
+            reference
+            for child in dd.children
+            for reference in self._write_block(output, url_names, child, tags[1:], leaves)
+        ]
+        url_name = url_names.allocate(tags[0], dd.identifier)
+        attrs = {}
+        if dd.title is not None:
+            attrs["display_name"] = dd.title
+        with output.open("{}/{}.xml".format(tags[0], url_name)) as stream:
+            writer = XmlWriter(stream)
+            writer.start(tags[0], attrs)
+            for child_tag, child_url_name in children:
+                writer.element(child_tag, {"url_name": child_url_name})
+            writer.end()
+        return [(tags[0], url_name)]
+
+    def _write_component(self, output, url_names, dd, tag, attrs, body):
+        url_name = url_names.allocate(tag, dd.identifier)
+        with output.open("{}/{}.xml".format(tag, url_name)) as stream:
+            if isinstance(body, ElementTree.Element):
+                XmlWriter(stream).tree(body)
+                return tag, url_name
+            if isinstance(body, str):
+                # A page already rendered to a file, see `_spool_body`.
+                attrs["filename"] = url_name
+                os.replace(body, os.path.join(output.root, "{}/{}.html".format(tag, url_name)))
+            elif body is not None:
+                # HTML bodies live in a separate file next to the block's XML.
+                attrs["filename"] = url_name
+                with output.open("{}/{}.html".format(tag, url_name), "wb") as html_stream:
+                    if isinstance(body, bytes):
+                        body = [body]
+                    for chunk in body:
+                        html_stream.write(chunk)
+            XmlWriter(stream).element(tag, attrs)
+        return tag, url_name
+
+    def _leaf_elements(self, dd):
+        """
+        Get the OLX components for the leaf `dd`, as a list of tuples of
+        tag, attributes and body.
 
-    def _add_olx_nodes(self, elt, data, tags):
-        leaf = not tags
-        for dd in data:
-            if leaf:
+        Most leaves give one component, whose body is HTML as UTF-8 bytes
+        (None for elements without a body).  Bodies of pages too big to read
+        in memory are iterables of chunks, read as they are written.  Assessments give
+        a problem per question, whose body is the whole problem, as an
+        `ElementTree.Element`.
+        """
+        type = None
+        base = ""
+        if dd.identifierref is not None:
+            idref = dd.identifierref
+            type, details = self._get_resource_content(idref)
+            base = self._resource_href(idref)
+        if type == "qti":
+            questions = details["questions"]
+            if questions:
+                return [
+                    self._problem_element(question, base, self._question_title(dd, index, len(questions)))
+                    for index, question in enumerate(questions, 1)
+                ]
+            type = None
+        if type == "static":
+            static_name = self.static_names.get(details["href"])
+            if static_name is None:
                 type = None
-                if "identifierref" in dd:
-                    idref = dd["identifierref"]
-                    type, details = self.cartridge.get_resource_content(idref)
-                if type is None:
-                    type = "html"
-                    details = {
-                        "html": "<p>MISSING CONTENT</p>",
-                    }
-                if type == "link":
-                    type, details = convert_link_to_video(details)
-                if type == "link":
-                    type = "html"
-                    details = {
-                        "html": "<a href='{}'>{}</a>".format(details["href"], details.get("text", "")),
-                    }
-                if type == "html":
-                    child = self.doc.createElement("html")
-                    txt = self.doc.createCDATASection(details["html"])
-                    child.appendChild(txt)
-                elif type == "video":
-                    child = self.doc.createElement("video")
-                    child.setAttribute("youtube", "1.00:" + details["youtube"])
-                    child.setAttribute("youtube_id_1_0", details["youtube"])
-                elif type == 'lti':
-                    child = self._create_lti_node(details)
-                else:
-                    raise Exception("WUT")
             else:
-                child = self.doc.createElement(tags[0])
-            if "title" in dd:
-                child.setAttribute("display_name", dd["title"])
-            elt.appendChild(child)
-            if "children" in dd:
-                self._add_olx_nodes(child, dd["children"], tags[1:])
-
-    def _create_lti_node(self, details):
-        node = self.doc.createElement('lti_consumer')
+                type = "link"
+                details = {
+                    "href": "/static/" + urllib.parse.quote(static_name),
+                    "text": dd.title or static_name,
+                }
+        if type is None:
+            type = "html"
+            details = {
+                "html": b"<p>MISSING CONTENT</p>",
+            }
+        if type == "link":
+            type, details = convert_link_to_video(details)
+        if type == "link":
+            type = "html"
+            details = {
+                "html": "<a href='{}'>{}</a>".format(details["href"], details.get("text", "")).encode("utf8"),
+            }
+        attrs = {}
+        body = None
+        if type == "html":
+            tag = "html"
+            body = self.link_rewriter.rewrite(details["html"], base)
+        elif type == "html_file":
+            tag = "html"
+            html = self.cartridge.iter_html(details["href"], COPY_CHUNK_SIZE)
+            body = self.link_rewriter.rewrite_chunks(html, base)
+        elif type == "video":
+            tag = "video"
+            attrs["youtube"] = "1.00:" + details["youtube"]
+            attrs["youtube_id_1_0"] = details["youtube"]
+        elif type == 'lti':
+            tag = 'lti_consumer'
+            attrs.update(self._create_lti_attrs(details))
+        else:
+            raise Exception("WUT")
+        if dd.title is not None:
+            attrs["display_name"] = dd.title
+        return [(tag, attrs, body)]
+
+    def _problem_element(self, question, base, default_title):
+        problem = qti.create_problem(
+            question,
+            lambda html: self.link_rewriter.rewrite_text(html, base),
+            default_title,
+        )
+        return problem.tag, problem.attrib, problem
+
+    def _question_title(self, dd, index, count):
+        """
+        Get the display name of question `index` of `count` in the quiz `dd`,
+        for questions without a title of their own.
+        """
+        if not dd.title or count == 1:
+            return dd.title
+        return "{} ({})".format(dd.title, index)
+
+    def _resource_href(self, identifier):
+        """
+        Get the href that relative URLs in the resource `identifier` are relative to.
+        """
+        res = self.cartridge.resources_by_id.get(identifier)
+        if res is None:
+            return ""
+        if res.href is not None:
+            return res.href
+        for res_file in res.children:
+            href = getattr(res_file, "href", None)
+            if href is not None:
+                return href
+        return ""
+
+    def _create_lti_attrs(self, details):
         custom_parameters = "[{params}]".format(
             params=', '.join([
                 '"{key}={value}"'.format(
@@ -76,16 +583,238 @@ class OlxExport:
                 for key, value in details['custom_parameters'].items()
             ]),
         )
-        node.setAttribute('custom_parameters', custom_parameters)
-        node.setAttribute('description', details['description'])
-        node.setAttribute('display_name', details['title'])
-        node.setAttribute('inline_height', details['height'])
-        node.setAttribute('inline_width', details['width'])
-        node.setAttribute('launch_url', details['launch_url'])
-        node.setAttribute('modal_height', details['height'])
-        node.setAttribute('modal_width', details['width'])
-        node.setAttribute('xblock-family', 'xblock.v1')
-        return node
+        attrs = {
+            'custom_parameters': custom_parameters,
+            'description': details['description'],
+            'display_name': details['title'],
+            'inline_height': details['height'],
+            'inline_width': details['width'],
+            'launch_url': details['launch_url'],
+            'modal_height': details['height'],
+            'modal_width': details['width'],
+            'xblock-family': 'xblock.v1',
+        }
+        return attrs
+
+
+class ChapterRenderer:
+    """
+    Render the components of whole chapters, in a process of the pool of
+    `OlxExport._rendering_in_processes`.
+
+    The cartridge is opened and normalized again in each process.
+
+    """
+    def __init__(self, file_path, config, conversion_cache, static_names, tags, spool_directory):
+        cartridge = Cartridge(file_path, config)
+        cartridge.conversion_cache = conversion_cache
+        cartridge.load()
+        cartridge.normalize()
+        self.export = OlxExport(cartridge)
+        self.export.static_names = static_names
+        self.export.link_rewriter = self.export._create_link_rewriter(tags)
+        self.tags = tags
+        self.spool_directory = spool_directory
+
+    def render(self, index):
+        """
+        Render the components of the leaves of chapter `index`.
+
+        Returns them, with the diagnostic events of the chapter: they are
+        counted here, and logged by the parent process, see `Diagnostics.merge`.
+
+        """
+        cartridge = self.export.cartridge
+        cartridge.diagnostics = Diagnostics(cartridge.diagnostics.name, log_limit=0)
+        chapter = cartridge.normalized.children[index]
+        leaves = [
+            [
+                (tag, attrs, _spool_body(body, self.spool_directory))
+                for tag, attrs, body in self.export._leaf_elements(dd)
+            ]
+            for dd in self.export._iter_leaf_blocks([chapter], self.tags)
+        ]
+        return leaves, cartridge.diagnostics.events
+
+
+# The `ChapterRenderer` of this process, in the pool of `_rendering_in_processes`.
+_chapter_renderer = None
+
+
+def _init_chapter_renderer(*args):
+    global _chapter_renderer
+    _chapter_renderer = ChapterRenderer(*args)
+
+
+def _render_chapter(index):
+    return _chapter_renderer.render(index)
+
+
+def _spool_body(body, directory):
+    """
+    Write a streamed page body to a file in `directory`, and return its path.
+
+    Other bodies are returned as they are.
+
+    """
+    if body is None or isinstance(body, (bytes, ElementTree.Element)):
+        return body
+    spool, path = tempfile.mkstemp(dir=directory, suffix=".html")
+    with open(spool, "wb") as spool_file:
+        for chunk in body:
+            spool_file.write(chunk)
+    return path
+
+
+class LinkRewriter:
+    """
+    Rewrite the references in HTML to the files and pages of the course.
+
+    `static_names` maps the hrefs of the files in static/ to their names
+    there, `resources_by_href` maps the hrefs of resources to them, and
+    `page_url_names` maps the identifiers of resources to the url_name of
+    the block showing them.
+
+    All the kinds of references are found in one pass, with REFERENCE_RE:
+
+    - $IMS-CC-FILEBASE$ references point to the files in static/.
+    - $WIKI_REFERENCE$/pages/ references, and relative URLs to other
+      pages, point to the blocks showing the pages.
+    - Relative URLs to files point to the files in static/.
+
+    References that can't be resolved are left as they are.  Each distinct
+    reference is only resolved once.
+
+    """
+    def __init__(self, static_names, resources_by_href, page_url_names):
+        # Maps each reference, and the directory it is relative to, to its
+        # replacement.
+        self.replacements = {}
+        self.resources_by_href = resources_by_href
+        self.page_url_names = page_url_names
+        self.static_names = dict(static_names)
+        # $IMS-CC-FILEBASE$ is the root of the course files, which exporters
+        # such as Canvas keep in web_resources/.
+        self.filebase_names = {}
+        for href, name in static_names.items():
+            self.filebase_names[href] = name
+            base, _, path = href.partition("/")
+            if base == WEB_RESOURCES and path:
+                self.filebase_names.setdefault(path, name)
+
+    def rewrite(self, html, base=""):
+        """
+        Rewrite the references in `html`, the UTF-8 content of the file at `base`.
+        """
+        if not self.static_names and not self.page_url_names:
+            # Nothing any reference could point to.
+            return html
+        directory = posixpath.dirname(base)
+        return REFERENCE_RE.sub(lambda match: self._replace(match, directory), html)
+
+    def rewrite_text(self, html, base=""):
+        """
+        Like `rewrite`, for HTML as a string.
+        """
+        return self.rewrite(html.encode("utf8"), base).decode("utf8")
+
+    def rewrite_chunks(self, chunks, base=""):
+        """
+        Like `rewrite`, over an iterable of UTF-8 bytes.
+
+        The text is rewritten in pieces, cut where no reference can straddle
+        the cut, so it can be written as it comes.
+
+        """
+        carry = b""
+        for chunk in chunks:
+            text = carry + chunk
+            cut = _safe_cut(text)
+            carry = text[cut:]
+            if cut:
+                yield self.rewrite(text[:cut], base)
+        if carry:
+            yield self.rewrite(carry, base)
+
+    def _replace(self, match, directory):
+        reference = match.group(0)
+        # Only relative URLs depend on where the page is.
+        key = (reference, directory if match.lastgroup == "relative" else None)
+        replacement = self.replacements.get(key)
+        if replacement is None:
+            replacement = self._resolve(match, directory)
+            self.replacements[key] = replacement
+        return replacement
+
+    def _resolve(self, match, directory):
+        kind = match.lastgroup
+        value = match.group(kind).decode("utf8", "replace")
+        if kind == "file":
+            url = self._static_url(self.filebase_names, value)
+        elif kind == "page":
+            href = "{}/{}.html".format(WIKI_CONTENT, urllib.parse.unquote(value))
+            url = self._page_url(href)
+        else:
+            url = self._relative_url(value, directory)
+            if url is not None:
+                # Keep the attribute the URL is in.
+                url = match.string[match.start():match.start(kind)].decode("utf8") + url
+        if url is None:
+            return match.group(0)
+        return url.encode("utf8")
+
+    def _relative_url(self, relative, directory):
+        path = relative.split("#", 1)[0].split("?", 1)[0]
+        if not path:
+            return None
+        href = posixpath.normpath(posixpath.join(directory, urllib.parse.unquote(path)))
+        url = self._static_url(self.static_names, href)
+        if url is None:
+            url = self._page_url(href)
+        if url is None:
+            return None
+        # Keep the query and the fragment: anchors in pages, pages of PDFs.
+        return url + relative[len(path):]
+
+    def _static_url(self, names, path):
+        name = names.get(urllib.parse.unquote(path))
+        if name is None:
+            return None
+        return "/static/" + urllib.parse.quote(name)
+
+    def _page_url(self, href):
+        resource = self.resources_by_href.get(href)
+        if resource is None:
+            return None
+        url_name = self.page_url_names.get(resource.identifier)
+        if url_name is None:
+            return None
+        return "/jump_to_id/" + url_name
+
+
+def _safe_cut(text):
+    """
+    Find where `text` can be cut without cutting a reference.
+    """
+    # A file or page reference can't cross a separator: what comes before
+    # the last one is safe.  After it, only a marker, or what may be the
+    # start of one, is held back: other "$" and "%", like the many of a
+    # URL-encoded data: URI, are not.
+    start = max(text.rfind(char) for char in REFERENCE_SEPARATORS) + 1
+    starts = [text.find(marker, start) for marker in REFERENCE_MARKERS]
+    starts = [index for index in starts if index != -1]
+    # The end of the text may be the start of a marker.
+    for index in range(max(start, len(text) - max(map(len, REFERENCE_MARKERS)) + 1), len(text)):
+        tail = text[index:]
+        if any(marker.startswith(tail) for marker in REFERENCE_MARKERS):
+            starts.append(index)
+            break
+    cut = min(starts, default=len(text))
+    # A relative URL keeps the start of its attribute with it.
+    partial = PARTIAL_ATTRIBUTE_RE.search(text, max(0, start - ATTRIBUTE_LOOKBEHIND))
+    if partial is not None:
+        cut = min(cut, partial.start())
+    return cut
 
 
 def convert_link_to_video(details):
@@ -97,9 +826,132 @@ def convert_link_to_video(details):
     return "link", details
 
 
-def onefile_tar_gz(filetgz, contents, string_name):
-    tarinfo = tarfile.TarInfo(string_name)
-    tarinfo.size = len(contents)
+class FolderOutput:
+    """
+    Write courses as OLX directories, with course.xml at their root, ready
+    to import as they are.
+    """
+    def __init__(self, config):
+        self.config = config
+
+    def default_path(self, workspace_directory):
+        """
+        Get the path of the output for the cartridge extracted to `workspace_directory`.
+        """
+        return workspace_directory + "-olx"
+
+    def write(self, export, path):
+        """
+        Write the course of the `OlxExport` `export` to `path`.
+        """
+        with self._replacing(path) as directory:
+            with export.cartridge.profile.phase('export'):
+                export.write_course(CourseDirectory(directory))
+
+    def copy(self, source, path):
+        """
+        Copy to `path` the output `source` written before, by the conversion cache.
+        """
+        with self._replacing(path) as directory:
+            shutil.copytree(source, directory, dirs_exist_ok=True)
+
+    @contextlib.contextmanager
+    def _replacing(self, path):
+        """
+        Yield a new directory next to `path`, and move it to `path` once done.
+
+        Only a course directory, with a course.xml, is replaced: anything
+        else at `path` is left alone, and FileExistsError is raised.
+
+        """
+        if os.path.lexists(path) and not os.path.isfile(os.path.join(path, "course.xml")):
+            raise FileExistsError("Not replacing {}: it isn't an OLX course directory".format(path))
+        filesystem.create_directory(os.path.dirname(os.path.abspath(path)))
+        directory = "{}-{}.tmp".format(path, uuid.uuid4().hex[:8])
+        os.mkdir(directory)
+        try:
+            yield directory
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        if os.path.exists(path):
+            previous = "{}-{}.old".format(path, uuid.uuid4().hex[:8])
+            os.replace(path, previous)
+            os.replace(directory, path)
+            shutil.rmtree(previous)
+        else:
+            os.replace(directory, path)
+
+
+class TarOutput(FolderOutput):
+    """
+    Write courses as tarballs, holding their OLX directory as "course", the
+    way Studio imports them.
+
+    The directory is written to a private directory of the workspace first,
+    and removed once tarred.
+
+    """
+    def default_path(self, workspace_directory):
+        return workspace_directory + tar_extension(self.config.compresslevel)
+
+    def write(self, export, path):
+        filesystem.create_directory(self.config.workspace)
+        directory = tempfile.mkdtemp(dir=self.config.workspace)
+        try:
+            with export.cartridge.profile.phase('export'):
+                export.write_course(CourseDirectory(directory))
+            with export.cartridge.profile.phase('tar'):
+                directory_tar_gz(path, directory, "course", self.config.compresslevel)
+        finally:
+            shutil.rmtree(directory)
+
+    def copy(self, source, path):
+        shutil.copyfile(source, path)
+
+
+# The writers of each `Config.output_format`: classes taking the `Config`,
+# with the interface of `FolderOutput`.
+OUTPUT_WRITERS = {
+    RESULT_TYPE_FOLDER: FolderOutput,
+    RESULT_TYPE_ZIP: TarOutput,
+}
+
+
+def get_output_writer(config):
+    try:
+        writer_class = OUTPUT_WRITERS[config.output_format]
+    except KeyError:
+        raise ValueError("Unknown output format: {!r}".format(config.output_format))
+    return writer_class(config)
+
+
+def open_tar(filename, compresslevel=9):
+    """
+    Open the tarball `filename` for writing.
+
+    `compresslevel` is the gzip level, from 1 (fastest) to 9 (smallest).  0
+    writes an uncompressed tar, for pipelines where throughput matters more
+    than size.
+
+    """
+    if compresslevel == 0:
+        return tarfile.open(filename, 'w')
+    return tarfile.open(filename, 'w:gz', compresslevel=compresslevel)
+
+
+def tar_extension(compresslevel=9):
+    if compresslevel == 0:
+        return ".tar"
+    return ".tar.gz"
+
+
+def directory_tar_gz(filetgz, directory, arcname, compresslevel=9):
+    """
+    Write a tarball holding `directory`, stored as `arcname`.
+
+    Files are streamed from disk into the archive one at a time.
 
-    with tarfile.open(filetgz, 'w:gz') as tgz:
-        tgz.addfile(tarinfo, io.BytesIO(contents))
+    """
+    with open_tar(filetgz, compresslevel) as tgz:
+        tgz.add(directory, arcname=arcname)
@@ -1,3 +1,359 @@
 """
 Convert QTI files to OLX
+
+Assessments are QTI 1.2 files, parsed incrementally into questions: dicts
+that can be dumped as JSON.  Each question becomes an OLX problem.
+
 """
+import html
+import html.entities
+import re
+import threading
+
+from xml.etree import ElementTree
+
+
+ASSESSMENT_TYPES = (
+    'imsqti_xmlv1p2/imscc_xmlv1p1/assessment',
+    'imsqti_xmlv1p2/imscc_xmlv1p2/assessment',
+    'imsqti_xmlv1p2/imscc_xmlv1p3/assessment',
+)
+
+MULTIPLE_CHOICE = 'multiple_choice'
+MULTIPLE_RESPONSE = 'multiple_response'
+FILL_IN_THE_BLANK = 'fill_in_the_blank'
+ESSAY = 'essay'
+
+# The title Canvas gives items that have none, also used for untitled problems.
+UNTITLED = 'Question'
+
+# The question types of the cc_profile of items, and of the question_type
+# Canvas adds to them.
+PROFILES = {
+    'cc.multiple_choice.v0p1': MULTIPLE_CHOICE,
+    'cc.true_false.v0p1': MULTIPLE_CHOICE,
+    'cc.multiple_response.v0p1': MULTIPLE_RESPONSE,
+    'cc.fib.v0p1': FILL_IN_THE_BLANK,
+    'cc.essay.v0p1': ESSAY,
+    'multiple_choice_question': MULTIPLE_CHOICE,
+    'true_false_question': MULTIPLE_CHOICE,
+    'multiple_answers_question': MULTIPLE_RESPONSE,
+    'short_answer_question': FILL_IN_THE_BLANK,
+    'essay_question': ESSAY,
+}
+
+# The question banks an assessment draws from, found without parsing it.
+SOURCEBANK_RE = re.compile(rb"<(?:[\w.-]+:)?sourcebank_ref\s*>\s*([^<\s]+)\s*<")
+# How much of an assessment is read at a time when looking for its banks.
+SCAN_CHUNK_SIZE = 64 * 1024
+# The longest text held back, between reads, in case it starts a sourcebank_ref.
+SOURCEBANK_MAX_SIZE = 4096
+ENTITY_RE = re.compile(r"&([A-Za-z][A-Za-z0-9]*);")
+TAG_RE = re.compile(r"<[^>]*>")
+# HTML elements that have no end tag, which XML needs closed.
+VOID_ELEMENT_RE = re.compile(r"<(area|base|br|col|embed|hr|img|input|link|meta|source|track|wbr)\b([^>]*?)/?>", re.IGNORECASE)
+
+
+def _local_name(tag):
+    return tag.rpartition('}')[2]
+
+
+def _children(element, name):
+    return [child for child in element if _local_name(child.tag) == name]
+
+
+def _descendants(element, name):
+    return [child for child in element.iter() if _local_name(child.tag) == name]
+
+
+class QtiParser:
+    """
+    Parse the QTI assessments of a cartridge into questions.
+
+    Question banks that assessments draw from are parsed once, and shared
+    by all the assessments of the cartridge.
+
+    """
+    def __init__(self, cartridge):
+        self.cartridge = cartridge
+        # Maps the identifier of each question bank to its questions.
+        self.banks = {}
+        self._banks_lock = threading.Lock()
+
+    def parse_assessment(self, resource):
+        """
+        Parse the assessment `resource`.
+
+        Returns a dict with the "title" of the assessment, and its
+        "questions", see `parse_item`.  Questions drawn from a question bank
+        are the first ones of the bank.
+
+        """
+        with self.cartridge.res_open(resource.children[0].href) as qti_file:
+            title, questions = self._parse_items(qti_file)
+        expanded = []
+        for question in questions:
+            if 'bank' in question:
+                bank = self.get_bank(question['bank'])
+                count = question['count']
+                expanded.extend(bank if count is None else bank[:count])
+            else:
+                expanded.append(question)
+        return {
+            'title': title,
+            'questions': expanded,
+        }
+
+    def get_bank_references(self, resource):
+        """
+        Get the identifiers of the question banks the assessment `resource`
+        draws from, with a quick scan of its file.
+
+        The file is read in chunks.  After each, only the text from its
+        last "<" is kept, since a sourcebank_ref cut by the end of the chunk
+        starts there.
+
+        """
+        identifiers = []
+        data = b''
+        with self.cartridge.res_open(resource.children[0].href) as qti_file:
+            for chunk in iter(lambda: qti_file.read(SCAN_CHUNK_SIZE), b''):
+                data += chunk
+                end = 0
+                for match in SOURCEBANK_RE.finditer(data):
+                    identifiers.append(match.group(1).decode('utf8'))
+                    end = match.end()
+                start = data.rfind(b'<', end)
+                if start < 0 or len(data) - start > SOURCEBANK_MAX_SIZE:
+                    data = b''
+                else:
+                    data = data[start:]
+        return identifiers
+
+    def get_bank(self, identifier):
+        """
+        Get the questions of the question bank `identifier`, parsed once.
+        """
+        with self._banks_lock:
+            if identifier not in self.banks:
+                resource = self.cartridge.resources_by_id.get(identifier)
+                questions = []
+                if resource is not None:
+                    with self.cartridge.res_open(resource.children[0].href) as qti_file:
+                        _, questions = self._parse_items(qti_file)
+                self.banks[identifier] = [question for question in questions if 'bank' not in question]
+            return self.banks[identifier]
+
+    def _parse_items(self, source):
+        """
+        Parse the items of the QTI file `source`, dropping each once parsed.
+
+        Returns the title of the assessment, and its questions, with
+        placeholders for the questions to draw from question banks.
+
+        """
+        title = None
+        questions = []
+        for event, element in ElementTree.iterparse(source, events=('start', 'end')):
+            name = _local_name(element.tag)
+            if event == 'start':
+                if name == 'assessment':
+                    title = element.get('title')
+                continue
+            if name == 'item':
+                questions.append(self.parse_item(element))
+                element.clear()
+            elif name == 'selection':
+                refs = _children(element, 'sourcebank_ref')
+                if refs and refs[0].text:
+                    numbers = _children(element, 'selection_number')
+                    count = None
+                    if numbers and (numbers[0].text or '').strip().isdigit():
+                        count = int(numbers[0].text)
+                    questions.append({'bank': refs[0].text.strip(), 'count': count})
+        return title, questions
+
+    def parse_item(self, item):
+        """
+        Parse the QTI `item` element into a question.
+
+        A question is a dict with the "ident", "title", "type" and "text"
+        (HTML) of the item.  Multiple choice and multiple response questions
+        have "choices", dicts of "ident" and "text" (HTML), and the idents
+        of the "correct" ones.  Fill in the blank questions have the
+        "correct" answers, and whether they are "case_sensitive".
+
+        """
+        question_type = self._get_question_type(item)
+        presentation = _children(item, 'presentation')
+        presentation = presentation[0] if presentation else item
+        mattexts = [
+            material
+            for child in presentation if _local_name(child.tag) == 'material'
+            for material in _descendants(child, 'mattext')
+        ]
+        question = {
+            'ident': item.get('ident'),
+            'title': item.get('title'),
+            'type': question_type,
+            'text': ''.join(_mattext_html(mattext) for mattext in mattexts),
+        }
+        if question_type in (MULTIPLE_CHOICE, MULTIPLE_RESPONSE):
+            question['choices'] = [
+                {
+                    'ident': label.get('ident'),
+                    'text': ''.join(_mattext_html(mattext) for mattext in _descendants(label, 'mattext')),
+                }
+                for label in _descendants(presentation, 'response_label')
+            ]
+            question['correct'] = self._get_correct_values(item)
+        elif question_type == FILL_IN_THE_BLANK:
+            question['correct'] = self._get_correct_values(item)
+            question['case_sensitive'] = any(
+                varequal.get('case', '').lower() == 'yes'
+                for varequal in _descendants(item, 'varequal')
+            )
+        return question
+
+    def _get_question_type(self, item):
+        for field in _descendants(item, 'qtimetadatafield'):
+            entry = _children(field, 'fieldentry')
+            label = _children(field, 'fieldlabel')
+            if not entry or not label:
+                continue
+            if label[0].text in ('cc_profile', 'question_type') and entry[0].text in PROFILES:
+                return PROFILES[entry[0].text]
+        # Without metadata, guess from the kind of response.
+        responses = _descendants(item, 'response_lid')
+        if responses:
+            if responses[0].get('rcardinality', '').lower() == 'multiple':
+                return MULTIPLE_RESPONSE
+            return MULTIPLE_CHOICE
+        if _descendants(item, 'response_str') and _descendants(item, 'varequal'):
+            return FILL_IN_THE_BLANK
+        return ESSAY
+
+    def _get_correct_values(self, item):
+        """
+        Get the values that score, in the response processing of `item`.
+
+        Values compared under a <not> don't count: they are the wrong
+        choices of multiple response questions.
+
+        """
+        values = []
+        for condition in _descendants(item, 'respcondition'):
+            if not any(_scores(setvar) for setvar in _children(condition, 'setvar')):
+                continue
+            for conditionvar in _children(condition, 'conditionvar'):
+                stack = list(conditionvar)
+                while stack:
+                    element = stack.pop(0)
+                    name = _local_name(element.tag)
+                    if name == 'varequal':
+                        value = (element.text or '').strip()
+                        if value and value not in values:
+                            values.append(value)
+                    elif name != 'not':
+                        stack[:0] = list(element)
+        return values
+
+
+def _scores(setvar):
+    try:
+        value = float(setvar.text)
+    except (TypeError, ValueError):
+        return False
+    return value > 0 and setvar.get('action', 'Set') in ('Set', 'Add')
+
+
+def _mattext_html(mattext):
+    text = mattext.text or ''
+    if mattext.get('texttype', 'text/plain') == 'text/html':
+        return text
+    return html.escape(text, quote=False)
+
+
+def create_problem(question, filter_html=None, default_title=None):
+    """
+    Create the OLX problem for `question`, as an `ElementTree.Element`.
+
+    `filter_html` is applied to the HTML of the question and its choices,
+    to rewrite links for example.  `default_title` is the display name of
+    the problem when the question has no title of its own.
+
+    """
+    filter_html = filter_html or (lambda text: text)
+    title = question['title']
+    if not title or title == UNTITLED:
+        title = default_title or UNTITLED
+    problem = ElementTree.Element('problem', {'display_name': title})
+    question_type = question['type']
+    if question_type == MULTIPLE_CHOICE:
+        response = ElementTree.SubElement(problem, 'multiplechoiceresponse')
+        _add_html(response, filter_html(question['text']))
+        group = ElementTree.SubElement(response, 'choicegroup', {'type': 'MultipleChoice'})
+        _add_choices(group, question, filter_html)
+    elif question_type == MULTIPLE_RESPONSE:
+        response = ElementTree.SubElement(problem, 'choiceresponse')
+        _add_html(response, filter_html(question['text']))
+        group = ElementTree.SubElement(response, 'checkboxgroup')
+        _add_choices(group, question, filter_html)
+    elif question_type == FILL_IN_THE_BLANK and question['correct']:
+        answers = question['correct']
+        response = ElementTree.SubElement(problem, 'stringresponse', {
+            'answer': answers[0],
+            'type': 'cs' if question['case_sensitive'] else 'ci',
+        })
+        _add_html(response, filter_html(question['text']))
+        for answer in answers[1:]:
+            ElementTree.SubElement(response, 'additional_answer', {'answer': answer})
+        ElementTree.SubElement(response, 'textline', {'size': '20'})
+    else:
+        # Essays aren't graded automatically: only their prompt is kept.
+        _add_html(problem, filter_html(question['text']))
+    return problem
+
+
+def _add_choices(group, question, filter_html):
+    for choice in question['choices']:
+        element = ElementTree.SubElement(group, 'choice', {
+            'correct': 'true' if choice['ident'] in question['correct'] else 'false',
+        })
+        content = parse_html(filter_html(choice['text']))
+        element.text = content.text
+        element.extend(content)
+
+
+def _add_html(parent, text):
+    # Loose text needs an element of its own, elements can go as they are.
+    content = parse_html(text)
+    if (content.text or '').strip() or any((child.tail or '').strip() for child in content):
+        parent.append(content)
+    else:
+        parent.extend(content)
+
+
+def parse_html(text):
+    """
+    Parse the HTML `text` into XML, as the content of a <div> element.
+
+    HTML that isn't well-formed XML is reduced to its text.
+
+    """
+    # XML only knows a few named entities: use numbers for the others.
+    text = ENTITY_RE.sub(_numeric_entity, text)
+    text = VOID_ELEMENT_RE.sub(r"<\1\2/>", text)
+    try:
+        return ElementTree.fromstring("<div>{}</div>".format(text))
+    except ElementTree.ParseError:
+        root = ElementTree.Element('div')
+        root.text = html.unescape(TAG_RE.sub(' ', text)).strip()
+        return root
+
+
+def _numeric_entity(match):
+    name = match.group(1)
+    if name in ('amp', 'lt', 'gt', 'quot', 'apos') or name not in html.entities.name2codepoint:
+        return match.group(0)
+    return "&#{};".format(html.entities.name2codepoint[name])
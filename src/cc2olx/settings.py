@@ -1,5 +1,5 @@
 import argparse
-import logging
+import dataclasses
 import os
 
 
@@ -7,12 +7,43 @@ COURSE_SETTINGS = 'course_settings.xml'
 MANIFEST = 'imsmanifest.xml'
 RESULT_TYPE_FOLDER = 'folder'
 RESULT_TYPE_ZIP = "zip"
-
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='{%(filename)s:%(lineno)d} - %(message)s',
+INVENTORY_FORMAT_JSON = 'json'
+INVENTORY_FORMAT_CSV = 'csv'
+WORKSPACE = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..', 'tmp')
 )
-logger = logging.getLogger()
+
+
+@dataclasses.dataclass(frozen=True)
+class Config:
+    """
+    How to convert cartridges.
+
+    Built once, from the command line or by library code, and passed to
+    `Cartridge` and the conversion pipeline.
+
+    """
+    # Where cartridges are extracted and results written.
+    workspace: str = WORKSPACE
+    # RESULT_TYPE_ZIP for a tarball of the course, RESULT_TYPE_FOLDER for
+    # an OLX directory to import as it is.
+    output_format: str = RESULT_TYPE_ZIP
+    # Extract whole cartridges to the workspace, instead of reading them in place.
+    extract: bool = False
+    # gzip level of the resulting tarball, 0 for no compression.
+    compresslevel: int = 9
+    # Measure the time and memory of each phase of conversions.
+    profile: bool = False
+    # Reuse the results of previous conversions of the same content.
+    cache: bool = False
+    # Threads reading resources ahead of the export, 0 to read them in turn.
+    prefetch: int = 4
+    # HTML pages bigger than this, in bytes, are streamed to the output
+    # instead of being read in memory.  0 reads all pages in memory.
+    stream_html_size: int = 4 * 1024 * 1024
+    # Processes exporting the chapters of a cartridge in parallel, 1 to
+    # export them in turn.
+    chapter_jobs: int = 1
 
 
 def _parse_args():
@@ -40,6 +71,14 @@ def _parse_args():
         nargs=1,
         help='Please provide the path to the directory containing imscc file(s).',
     )
+    group.add_argument(
+        '-w',
+        '--worker',
+        nargs='?',
+        const='-',
+        metavar='SOCKET',
+        help='Run as a long-lived worker, reading conversion jobs as JSON lines from stdin, or from the Unix socket SOCKET.',
+    )
     parser.add_argument(
         '-ll',
         '--loglevel',
@@ -61,12 +100,77 @@ def _parse_args():
             RESULT_TYPE_FOLDER,
             RESULT_TYPE_ZIP,
         ],
-        default=RESULT_TYPE_FOLDER,
-        help="Please provide the way in which final result has to be. It can take one of the following values, {folder}, {zip} as argument.".format(
+        default=RESULT_TYPE_ZIP,
+        help="Please provide the way in which final result has to be. It can take one of the following values, {folder} (an OLX directory, not compressed), {zip} (a tarball, the default) as argument.".format(
             folder=RESULT_TYPE_FOLDER,
             zip=RESULT_TYPE_ZIP,
         ),
     )
+    parser.add_argument(
+        '-x',
+        '--extract',
+        action='store_true',
+        help='Extract the whole cartridge into the workspace before converting, instead of reading its files straight from the archive.',
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        help='Please provide the number of files to convert in parallel. Use 0 to use all the CPUs.',
+    )
+    parser.add_argument(
+        '-z',
+        '--compresslevel',
+        type=int,
+        choices=range(10),
+        default=9,
+        help='Please provide the gzip compression level of the result, from 1 (fastest) to 9 (smallest). 0 writes an uncompressed .tar file.',
+    )
+    parser.add_argument(
+        '-p',
+        '--profile',
+        action='store_true',
+        help='Measure the time and memory of each phase of the conversions, and write them as JSON reports.',
+    )
+    parser.add_argument(
+        '-c',
+        '--cache',
+        action='store_true',
+        help='Keep conversion results in the workspace, and reuse them for cartridges and resources that have not changed.',
+    )
+    parser.add_argument(
+        '--prefetch',
+        type=int,
+        default=4,
+        help='Please provide the number of threads reading resources ahead of the export. 0 reads them one at a time.',
+    )
+    parser.add_argument(
+        '--stream-html-size',
+        type=int,
+        default=4 * 1024 * 1024,
+        help='Please provide the size, in bytes, above which HTML pages are streamed to the output instead of being read in memory. 0 reads all pages in memory.',
+    )
+    parser.add_argument(
+        '--chapter-jobs',
+        type=int,
+        default=1,
+        help='Please provide the number of processes exporting the chapters of each file in parallel, for very big courses. Use 0 to use all the CPUs.',
+    )
+    parser.add_argument(
+        '-i',
+        '--inventory',
+        nargs='?',
+        const=INVENTORY_FORMAT_JSON,
+        choices=[
+            INVENTORY_FORMAT_JSON,
+            INVENTORY_FORMAT_CSV,
+        ],
+        help='Do not convert: only read the manifests, and write an inventory of the cartridges to stdout, as {json} (the default) or {csv}.'.format(
+            json=INVENTORY_FORMAT_JSON,
+            csv=INVENTORY_FORMAT_CSV,
+        ),
+    )
     args = parser.parse_args()
     return args
 
@@ -100,23 +204,38 @@ def _get_input(args):
     return result_type
 
 
+def _get_jobs(jobs):
+    if jobs < 1:
+        jobs = os.cpu_count() or 1
+    return jobs
+
+
 def collect_settings():
     args = _parse_args()
     input_files = _get_files(args)
     log_level = _get_log_level(args)
     output_format = _get_input(args)
-    dir_path = os.path.dirname(os.path.abspath(__file__))
-    temp_folder_name = 'tmp'
-    workspace = os.path.join(dir_path, '../..', temp_folder_name)
-    workspace = os.path.normpath(workspace)
+    config = Config(
+        workspace=WORKSPACE,
+        output_format=output_format,
+        extract=args.extract,
+        compresslevel=args.compresslevel,
+        profile=args.profile,
+        cache=args.cache,
+        prefetch=args.prefetch,
+        stream_html_size=args.stream_html_size,
+        chapter_jobs=_get_jobs(args.chapter_jobs),
+    )
     logging_config = {
         'level': log_level,
         'format': '{%(filename)s:%(lineno)d} - %(message)s',
     }
     settings = {
         'input_files': input_files,
-        'output_format': output_format,
         'logging_config': logging_config,
-        'workspace': workspace,
+        'jobs': _get_jobs(args.jobs),
+        'worker': args.worker,
+        'inventory': args.inventory,
+        'config': config,
     }
     return settings
@@ -0,0 +1,89 @@
+"""
+A long-running conversion worker.
+
+Jobs are JSON objects, one per line::
+
+    {"id": "job-1", "input": "/path/to/course.imscc", "output": "/path/to/course.tar.gz"}
+
+Only "input" is required.  "output" is a directory when the worker runs with
+``-r folder``.  For each job, the worker writes one line with the
+JSON report of the conversion (see `conversion.convert`), with the job's "id".
+Reusing one warm process avoids paying interpreter startup and imports for
+every cartridge.
+
+"""
+import json
+import os
+import socketserver
+import stat
+import sys
+
+from cc2olx import conversion
+
+
+def handle_job(line, config):
+    """
+    Run the job described by the JSON `line`, and return its report.
+    """
+    try:
+        job = json.loads(line)
+        source = job['input']
+    except (ValueError, TypeError, KeyError) as exc:
+        return {'id': None, 'error': "Bad job {!r}: {}".format(line, exc)}
+    report = conversion.safe_convert(source, job.get('output'), config)
+    report['id'] = job.get('id')
+    return report
+
+
+def serve_lines(lines, output, config):
+    """
+    Run the jobs read from `lines`, writing their reports to `output`.
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        report = handle_job(line, config)
+        output.write(json.dumps(report) + "\n")
+        output.flush()
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        lines = (line.decode('utf8') for line in self.rfile)
+        serve_lines(lines, _SocketWriter(self.wfile), self.server.config)
+
+
+class _SocketWriter:
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, text):
+        self.wfile.write(text.encode('utf8'))
+
+    def flush(self):
+        self.wfile.flush()
+
+
+def serve(config, socket_path=None):
+    """
+    Serve conversion jobs until the input ends.
+
+    Jobs are read from stdin, or from connections to the Unix socket at
+    `socket_path` when it is given.  A socket left at `socket_path` by a
+    previous worker is replaced: anything else there is left alone, and
+    FileExistsError is raised.
+
+    """
+    if socket_path is None:
+        serve_lines(sys.stdin, sys.stdout, config)
+        return
+    if os.path.lexists(socket_path):
+        if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+            raise FileExistsError("Not replacing {}: it isn't a socket".format(socket_path))
+        os.remove(socket_path)
+    with socketserver.UnixStreamServer(socket_path, _JobHandler) as server:
+        server.config = config
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
@@ -0,0 +1,74 @@
+"""
+Check how the encoding of HTML files is detected, and how they are transcoded.
+
+    PYTHONPATH=./src python3 -m unittest discover tests
+
+"""
+import codecs
+import unittest
+
+from cc2olx import charsets
+
+
+PAGE = "<p>It’s café</p>"
+
+
+class DetectEncodingTest(unittest.TestCase):
+    def test_byte_order_marks(self):
+        self.assertEqual(charsets.detect_encoding(codecs.BOM_UTF8 + b"<p>"), "utf-8-sig")
+        self.assertEqual(charsets.detect_encoding(PAGE.encode("utf-16")), "utf-16")
+        self.assertEqual(charsets.detect_encoding(PAGE.encode("utf-32")), "utf-32")
+
+    def test_meta_charset(self):
+        self.assertEqual(charsets.detect_encoding(b'<meta charset="koi8-r"><p>'), "koi8-r")
+        head = b'<meta http-equiv="Content-Type" content="text/html; charset=Shift_JIS">'
+        self.assertEqual(charsets.detect_encoding(head), "shift_jis")
+
+    def test_meta_charset_labels_as_browsers(self):
+        self.assertEqual(charsets.detect_encoding(b'<meta charset="iso-8859-1">'), "cp1252")
+        self.assertEqual(charsets.detect_encoding(b'<meta charset="latin1">'), "cp1252")
+        # ASCII labels are ignored: the content decides.
+        utf8 = '<meta charset="us-ascii">{}'.format(PAGE).encode("utf8")
+        self.assertEqual(charsets.detect_encoding(utf8), "utf-8")
+
+    def test_unknown_or_wide_meta_charset_is_ignored(self):
+        self.assertEqual(charsets.detect_encoding(b'<meta charset="nonsense"><p>'), "utf-8")
+        self.assertEqual(charsets.detect_encoding(b'<meta charset="utf-16"><p>'), "utf-8")
+
+    def test_sniffed_utf8(self):
+        self.assertEqual(charsets.detect_encoding(PAGE.encode("utf8")), "utf-8")
+
+    def test_sniffing_ignores_a_character_cut_at_the_end(self):
+        head = ("a" * (charsets.SNIFF_SIZE - 1) + "é").encode("utf8")
+        self.assertEqual(charsets.detect_encoding(head), "utf-8")
+
+    def test_cp1252_fallback(self):
+        self.assertEqual(charsets.detect_encoding(PAGE.encode("cp1252")), charsets.FALLBACK_ENCODING)
+
+
+class ToUtf8Test(unittest.TestCase):
+    def test_utf8_is_kept_as_it_is(self):
+        data = PAGE.encode("utf8")
+        self.assertIs(charsets.to_utf8(data), data)
+
+    def test_utf8_bom_is_dropped(self):
+        self.assertEqual(charsets.to_utf8(codecs.BOM_UTF8 + PAGE.encode("utf8")), PAGE.encode("utf8"))
+
+    def test_utf16(self):
+        self.assertEqual(charsets.to_utf8(PAGE.encode("utf-16")), PAGE.encode("utf8"))
+
+    def test_declared_latin1_is_read_as_cp1252(self):
+        page = '<meta charset="iso-8859-1">' + PAGE
+        self.assertEqual(charsets.to_utf8(page.encode("cp1252")), page.encode("utf8"))
+
+    def test_cp1252_fallback(self):
+        self.assertEqual(charsets.to_utf8(PAGE.encode("cp1252")), PAGE.encode("utf8"))
+
+    def test_chunks_are_decoded_across_their_boundaries(self):
+        data = PAGE.encode("utf-16")
+        chunks = [data[start:start + 3] for start in range(0, len(data), 3)]
+        self.assertEqual(b"".join(charsets.iter_utf8(chunks)), PAGE.encode("utf8"))
+
+
+if __name__ == "__main__":
+    unittest.main()
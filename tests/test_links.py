@@ -0,0 +1,67 @@
+"""
+Check how links are rewritten, whole and in chunks.
+
+    PYTHONPATH=./src python3 -m unittest discover tests
+
+"""
+import unittest
+
+from cc2olx.olx import LinkRewriter
+
+
+class Page:
+    def __init__(self, identifier):
+        self.identifier = identifier
+
+
+def split(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+class ChunkedRewriteTest(unittest.TestCase):
+    def setUp(self):
+        self.rewriter = LinkRewriter(
+            {"web_resources/img/a b.png": "a b.png"},
+            {"wiki_content/other.html": Page("other")},
+            {"other": "item_2"},
+        )
+
+    def assertSameAsWhole(self, html, size):
+        chunks = list(self.rewriter.rewrite_chunks(split(html, size)))
+        self.assertEqual(b"".join(chunks), self.rewriter.rewrite(html))
+        return chunks
+
+    def test_references_split_anywhere(self):
+        html = (
+            b'<p><img src="$IMS-CC-FILEBASE$/img/a%20b.png"/>'
+            b'<a href="%24WIKI_REFERENCE%24/pages/other">next</a>'
+            b'<a href="other.html">again</a> ]]> %24IMS-CC-FILEBASE%24/img/a%20b.png</p>'
+        )
+        for size in range(1, len(html) + 1):
+            self.assertSameAsWhole(html, size)
+
+    def test_encoded_data_uri_is_not_held_back(self):
+        # A data: URI has no separators and many "%": chunks must still be
+        # written as they come, not held back to the end of the URI.
+        uri = b"%3Csvg%20width%3D%2210%22%2F%3E" * 20000
+        html = b'<img src="data:image/svg+xml,' + uri + b'"/> $IMS-CC-FILEBASE$/img/a%20b.png'
+        chunks = self.assertSameAsWhole(html, 4096)
+        self.assertLess(max(len(chunk) for chunk in chunks), 2 * 4096)
+
+
+class RelativeUrlTest(unittest.TestCase):
+    def test_query_and_fragment_are_kept(self):
+        rewriter = LinkRewriter(
+            {"web_resources/doc.pdf": "doc.pdf"},
+            {"wiki_content/other.html": Page("other")},
+            {"other": "item_2"},
+        )
+        html = b'<a href="other.html#part2">a</a><a href="../web_resources/doc.pdf?dl=1#page=3">b</a>'
+        self.assertEqual(
+            rewriter.rewrite(html, "wiki_content/page.html"),
+            b'<a href="/jump_to_id/item_2#part2">a</a><a href="/static/doc.pdf?dl=1#page=3">b</a>',
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+"""
+Check the organizations and resources that the streaming manifest parser
+builds, against a plain parse of the whole manifest.
+
+    PYTHONPATH=./src python3 -m unittest discover tests
+
+"""
+import glob
+import io
+import os.path
+import unittest
+import zipfile
+
+from xml.etree import ElementTree
+
+from cc2olx.models import Cartridge, ResourceDependency, ResourceFile
+
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_data")
+
+MANIFEST = b"""<?xml version="1.0"?>
+<manifest identifier="m" xmlns="http://www.imsglobal.org/xsd/imsccv1p1/imscp_v1p1">
+  <metadata><schema>IMS Common Cartridge</schema><schemaversion>1.1.0</schemaversion></metadata>
+  <organizations>
+    <organization identifier="org" structure="rooted-hierarchy">
+      <item identifier="root">
+        <item identifier="chapter">
+          <title>Chapter</title>
+          <item identifier="page" identifierref="res"><title>Page</title></item>
+          <item><item/></item>
+        </item>
+      </item>
+    </organization>
+  </organizations>
+  <resources>
+    <resource identifier="res" type="webcontent" href="page.html">
+      <file href="page.html"/>
+      <dependency identifierref="img"/>
+    </resource>
+    <resource identifier="img" type="webcontent"><file href="img.png"/></resource>
+  </resources>
+</manifest>
+"""
+
+
+def local_name(tag):
+    return tag.rpartition("}")[2]
+
+
+def expected_item(element):
+    """
+    Describe the item `element` as a tuple, or None if it is empty.
+    """
+    titles = [child.text for child in element if local_name(child.tag) == "title" and child.text]
+    children = [expected_item(child) for child in element if local_name(child.tag) == "item"]
+    item = (
+        element.get("identifier") or None,
+        element.get("identifierref") or None,
+        titles[0] if titles else None,
+        [child for child in children if child is not None],
+    )
+    if item == (None, None, None, []):
+        return None
+    return item
+
+
+def expected_manifest(root):
+    organizations = [
+        (organization.get("identifier"), organization.get("structure"), [
+            item for item in map(expected_item, organization) if item is not None
+        ])
+        for organization in root.iter()
+        if local_name(organization.tag) == "organization"
+    ]
+    resources = [
+        (resource.get("identifier"), resource.get("type"), resource.get("href"), [
+            (local_name(child.tag), child.get("href") or child.get("identifierref"))
+            for child in resource if local_name(child.tag) in ("file", "dependency")
+        ])
+        for resource in root.iter()
+        if local_name(resource.tag) == "resource"
+    ]
+    return organizations, resources
+
+
+def describe_item(item):
+    return (item.identifier, item.identifierref, item.title, [describe_item(child) for child in item.children])
+
+
+def describe_child(child):
+    if isinstance(child, ResourceFile):
+        return ("file", child.href)
+    if isinstance(child, ResourceDependency):
+        return ("dependency", child.identifierref)
+    return (None, None)
+
+
+def describe_manifest(data):
+    organizations = [
+        (organization.identifier, organization.structure, [describe_item(item) for item in organization.children])
+        for organization in data["organizations"]
+    ]
+    resources = [
+        (resource.identifier, resource.type, resource.href, [describe_child(child) for child in resource.children])
+        for resource in data["resources"]
+    ]
+    return organizations, resources
+
+
+def zip_of(manifest):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as archive:
+        archive.writestr("imsmanifest.xml", manifest)
+    return data.getvalue()
+
+
+def parse_stream(cartridge, manifest):
+    data = cartridge.parse_manifest_stream(io.BytesIO(manifest))
+    return data, describe_manifest(data)
+
+
+class ParseManifestStreamTest(unittest.TestCase):
+    def test_items_and_resources(self):
+        with Cartridge(io.BytesIO(zip_of(MANIFEST))) as cartridge:
+            data, (organizations, resources) = parse_stream(cartridge, MANIFEST)
+        self.assertEqual(data["metadata"]["schema"], {"name": "IMS Common Cartridge", "version": "1.1.0"})
+        self.assertEqual(organizations, [
+            ("org", "rooted-hierarchy", [
+                ("root", None, None, [
+                    ("chapter", None, "Chapter", [
+                        ("page", "res", "Page", []),
+                    ]),
+                ]),
+            ]),
+        ])
+        self.assertEqual(resources, [
+            ("res", "webcontent", "page.html", [("file", "page.html"), ("dependency", "img")]),
+            ("img", "webcontent", None, [("file", "img.png")]),
+        ])
+
+    def test_same_as_whole_parse_for_test_data(self):
+        paths = sorted(glob.glob(os.path.join(TEST_DATA, "*.imscc")))
+        self.assertTrue(paths)
+        for path in paths:
+            with self.subTest(cartridge=os.path.basename(path)), Cartridge(path) as cartridge:
+                with cartridge.cartridge.open("imsmanifest.xml") as manifest_file:
+                    manifest = manifest_file.read()
+                _, described = parse_stream(cartridge, manifest)
+                self.assertEqual(described, expected_manifest(ElementTree.fromstring(manifest)))
+
+
+if __name__ == "__main__":
+    unittest.main()
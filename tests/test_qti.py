@@ -0,0 +1,205 @@
+"""
+Check how QTI items are parsed into questions, and turned into OLX problems.
+
+    PYTHONPATH=./src python3 -m unittest discover tests
+
+"""
+import io
+import unittest
+
+from xml.etree import ElementTree
+
+from cc2olx import qti
+
+
+def metadata(profile):
+    return (
+        '<itemmetadata><qtimetadata><qtimetadatafield>'
+        '<fieldlabel>cc_profile</fieldlabel><fieldentry>{}</fieldentry>'
+        '</qtimetadatafield></qtimetadata></itemmetadata>'
+    ).format(profile)
+
+
+def choice_item(ident, profile, choices, correct, cardinality="Single"):
+    labels = "".join(
+        '<response_label ident="{}"><material><mattext>{}</mattext></material></response_label>'.format(
+            choice_ident, text,
+        )
+        for choice_ident, text in choices
+    )
+    if cardinality == "Multiple":
+        conditions = "".join("<varequal respident=\"r\">{}</varequal>".format(value) for value in correct)
+        conditions = "<and>{}</and>".format(conditions)
+    else:
+        conditions = "<varequal respident=\"r\">{}</varequal>".format(correct[0])
+    return (
+        '<item ident="{ident}" title="{ident} title">{metadata}'
+        '<presentation><material><mattext texttype="text/html">&lt;p&gt;{ident}?&lt;/p&gt;</mattext></material>'
+        '<response_lid ident="r" rcardinality="{cardinality}"><render_choice>{labels}</render_choice></response_lid>'
+        '</presentation>'
+        '<resprocessing><respcondition><conditionvar>{conditions}</conditionvar>'
+        '<setvar action="Set" varname="SCORE">100</setvar></respcondition></resprocessing>'
+        '</item>'
+    ).format(
+        ident=ident,
+        metadata=metadata(profile),
+        cardinality=cardinality,
+        labels=labels,
+        conditions=conditions,
+    )
+
+
+MULTIPLE_CHOICE_ITEM = choice_item(
+    "mc", "cc.multiple_choice.v0p1", [("a", "3"), ("b", "4")], ["b"],
+)
+TRUE_FALSE_ITEM = choice_item(
+    "tf", "cc.true_false.v0p1", [("t", "True"), ("f", "False")], ["t"],
+)
+MULTIPLE_RESPONSE_ITEM = choice_item(
+    "mr", "cc.multiple_response.v0p1", [("a", "2"), ("b", "3"), ("c", "4")], ["a", "b"], "Multiple",
+)
+FILL_IN_THE_BLANK_ITEM = (
+    '<item ident="fib" title="fib title">' + metadata("cc.fib.v0p1") +
+    '<presentation><material><mattext>Capital of France?</mattext></material>'
+    '<response_str ident="r"><render_fib/></response_str></presentation>'
+    '<resprocessing><respcondition><conditionvar>'
+    '<varequal respident="r" case="No">Paris</varequal><varequal respident="r" case="No">paris</varequal>'
+    '</conditionvar><setvar action="Set" varname="SCORE">100</setvar></respcondition></resprocessing>'
+    '</item>'
+)
+ESSAY_ITEM = (
+    '<item ident="essay" title="essay title">' + metadata("cc.essay.v0p1") +
+    '<presentation><material><mattext>Why &amp; how?</mattext></material>'
+    '<response_str ident="r"><render_fib/></response_str></presentation>'
+    '</item>'
+)
+
+
+def parse_item(text):
+    return qti.QtiParser(None).parse_item(ElementTree.fromstring(text))
+
+
+class Resource:
+    def __init__(self, href):
+        self.children = [File(href)]
+
+
+class File:
+    def __init__(self, href):
+        self.href = href
+
+
+class Cartridge:
+    """
+    The part of `models.Cartridge` that `QtiParser` uses, over files in memory.
+    """
+    def __init__(self, files, resources_by_id):
+        self.files = files
+        self.resources_by_id = resources_by_id
+
+    def res_open(self, file_name):
+        return io.BytesIO(self.files[file_name].encode("utf8"))
+
+
+class ParseItemTest(unittest.TestCase):
+    def test_multiple_choice(self):
+        question = parse_item(MULTIPLE_CHOICE_ITEM)
+        self.assertEqual(question["type"], qti.MULTIPLE_CHOICE)
+        self.assertEqual(question["title"], "mc title")
+        self.assertEqual(question["text"], "<p>mc?</p>")
+        self.assertEqual(question["choices"], [
+            {"ident": "a", "text": "3"},
+            {"ident": "b", "text": "4"},
+        ])
+        self.assertEqual(question["correct"], ["b"])
+
+    def test_true_false(self):
+        question = parse_item(TRUE_FALSE_ITEM)
+        self.assertEqual(question["type"], qti.MULTIPLE_CHOICE)
+        self.assertEqual(question["correct"], ["t"])
+
+    def test_multiple_response(self):
+        question = parse_item(MULTIPLE_RESPONSE_ITEM)
+        self.assertEqual(question["type"], qti.MULTIPLE_RESPONSE)
+        self.assertEqual([choice["ident"] for choice in question["choices"]], ["a", "b", "c"])
+        self.assertEqual(question["correct"], ["a", "b"])
+
+    def test_fill_in_the_blank(self):
+        question = parse_item(FILL_IN_THE_BLANK_ITEM)
+        self.assertEqual(question["type"], qti.FILL_IN_THE_BLANK)
+        self.assertEqual(question["correct"], ["Paris", "paris"])
+        self.assertFalse(question["case_sensitive"])
+
+    def test_essay(self):
+        question = parse_item(ESSAY_ITEM)
+        self.assertEqual(question["type"], qti.ESSAY)
+        self.assertEqual(question["text"], "Why &amp; how?")
+
+
+class CreateProblemTest(unittest.TestCase):
+    def test_multiple_choice(self):
+        problem = qti.create_problem(parse_item(MULTIPLE_CHOICE_ITEM))
+        self.assertEqual(problem.get("display_name"), "mc title")
+        choices = problem.findall("multiplechoiceresponse/choicegroup/choice")
+        self.assertEqual([choice.text for choice in choices], ["3", "4"])
+        self.assertEqual([choice.get("correct") for choice in choices], ["false", "true"])
+        self.assertEqual(problem.find("multiplechoiceresponse/p").text, "mc?")
+
+    def test_multiple_response(self):
+        problem = qti.create_problem(parse_item(MULTIPLE_RESPONSE_ITEM))
+        choices = problem.findall("choiceresponse/checkboxgroup/choice")
+        self.assertEqual([choice.get("correct") for choice in choices], ["true", "true", "false"])
+
+    def test_fill_in_the_blank(self):
+        problem = qti.create_problem(parse_item(FILL_IN_THE_BLANK_ITEM))
+        response = problem.find("stringresponse")
+        self.assertEqual(response.get("answer"), "Paris")
+        self.assertEqual(response.get("type"), "ci")
+        self.assertEqual([answer.get("answer") for answer in response.findall("additional_answer")], ["paris"])
+        self.assertIsNotNone(response.find("textline"))
+
+    def test_essay(self):
+        problem = qti.create_problem(parse_item(ESSAY_ITEM))
+        self.assertEqual(list(problem), [problem.find("div")])
+        self.assertEqual(problem.find("div").text, "Why & how?")
+
+    def test_untitled_question_uses_default_title(self):
+        question = dict(parse_item(ESSAY_ITEM), title=qti.UNTITLED)
+        problem = qti.create_problem(question, default_title="Quiz (2)")
+        self.assertEqual(problem.get("display_name"), "Quiz (2)")
+
+    def test_html_is_filtered(self):
+        problem = qti.create_problem(parse_item(MULTIPLE_CHOICE_ITEM), lambda html: html.replace("4", "four"))
+        self.assertEqual(problem.findall("multiplechoiceresponse/choicegroup/choice")[1].text, "four")
+
+
+class QuestionBankTest(unittest.TestCase):
+    def setUp(self):
+        bank = "<questestinterop><objectbank>{}{}{}</objectbank></questestinterop>".format(
+            MULTIPLE_CHOICE_ITEM, TRUE_FALSE_ITEM, ESSAY_ITEM,
+        )
+        quiz = (
+            '<questestinterop><assessment title="Quiz"><section>'
+            + FILL_IN_THE_BLANK_ITEM +
+            '<section><selection_ordering><selection>'
+            '<sourcebank_ref>bank</sourcebank_ref><selection_number>2</selection_number>'
+            '</selection></selection_ordering></section>'
+            '</section></assessment></questestinterop>'
+        )
+        self.parser = qti.QtiParser(Cartridge(
+            {"quiz.xml": quiz, "bank.xml": bank},
+            {"bank": Resource("bank.xml")},
+        ))
+        self.quiz = Resource("quiz.xml")
+
+    def test_selection_draws_from_bank(self):
+        assessment = self.parser.parse_assessment(self.quiz)
+        self.assertEqual(assessment["title"], "Quiz")
+        self.assertEqual([question["ident"] for question in assessment["questions"]], ["fib", "mc", "tf"])
+
+    def test_bank_references(self):
+        self.assertEqual(self.parser.get_bank_references(self.quiz), ["bank"])
+
+
+if __name__ == "__main__":
+    unittest.main()